@@ -0,0 +1,179 @@
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import time
+import numpy as np
+from src.Gridworld.Gridworld import Gridworld, generate_boards
+from fuzzing import get_fitness, get_first_trace, initialize_population, genetic_algorithm, encode_trace, get_actions
+
+# Timings of the hot paths of fuzzing.py and Gridworld.py over a sweep of board sizes and population sizes.
+# Every case is set up from fixed seeds so two runs time the same work, the results are written as JSON and
+# --compare prints the speedup of this run over an earlier JSON file (e.g. one made on another commit).
+#
+# Each benchmark sweeps one parameter, 'size' (board size, scaled by the number of cells) or 'pop' (population size).
+# The scaling section holds the local exponent between neighbouring points of every sweep: ~1 is linear in the
+# swept quantity, the first point where it goes over SUPERLINEAR is reported as where the complexity stops being linear.
+
+SIZES = [4, 8, 16, 32, 64, 128, 256]
+POP_SIZES = [4, 10, 100, 1000, 10000]
+QUICK_SIZES = [4, 8, 16, 32]
+QUICK_POP_SIZES = [4, 10, 100]
+SUPERLINEAR = 1.25
+
+# Solvable board of the given size, the same for every run with the same seed
+def make_game(size, seed):
+    cells, player_pos = generate_boards(1, size, np.random.default_rng(seed))
+    return Gridworld.from_layout(cells[0], player_pos[0])
+
+def seed_all(seed):
+    random.seed(seed)
+    np.random.seed(seed)
+
+# Each benchmark is (sweep, setup(value, args) -> state, run(state)), only run is timed.
+# setup is called again before every timed run because some of them change their state (the GA, the trace marks).
+
+def setup_get_fitness(size, args):
+    game = make_game(size, args.seed)
+    trace = encode_trace(get_actions(get_first_trace(game, 'r')))
+    # Some random moves after the path so illegal moves and pits are scored too
+    trace.extend(random.choice(range(4)) for _ in range(size))
+    return game, trace
+
+def setup_get_first_trace(size, args):
+    return make_game(size, args.seed), 'r'
+
+def setup_initialize_population(pop_size, args):
+    return pop_size, make_game(args.board_size, args.seed), 'dfs', np.random.default_rng(args.seed)
+
+def setup_genetic_algorithm(pop_size, args):
+    game = make_game(args.board_size, args.seed)
+    return initialize_population(pop_size, game, rng=np.random.default_rng(args.seed)), game, args.generations
+
+def setup_genetic_algorithm_size(size, args):
+    game = make_game(size, args.seed)
+    return initialize_population(args.pop_size, game, rng=np.random.default_rng(args.seed)), game, args.generations
+
+def run_genetic_algorithm(state):
+    population, game, generations = state
+    genetic_algorithm(population, game, generations, .7, .1, [], 0)
+
+def setup_render(size, args):
+    return make_game(size, args.seed).board
+
+BENCHMARKS = {
+    "get_fitness": ('size', setup_get_fitness, lambda state: get_fitness(*state)),
+    "get_first_trace": ('size', setup_get_first_trace, lambda state: get_first_trace(*state)),
+    "initialize_population": ('pop', setup_initialize_population, lambda state: initialize_population(*state)),
+    "genetic_algorithm": ('pop', setup_genetic_algorithm, run_genetic_algorithm),
+    "genetic_algorithm_size": ('size', setup_genetic_algorithm_size, run_genetic_algorithm),
+    "initGridRand": ('size', lambda size, args: (size, np.random.default_rng(args.seed)), lambda state: Gridworld(size=state[0], mode='random', rng=state[1])),
+    "render_np": ('size', setup_render, lambda board: board.render_np()),
+    "render_obs": ('size', setup_render, lambda board: board.render_obs()),
+}
+
+# render_np has a layer per piece, (pieces x size x size) grows with size^4 and does not fit in memory past this
+MAX_SIZE = {"render_np": 128}
+
+# Time run(setup()) at least min_repeat times and until min_time seconds of runs are done (at most max_repeat runs)
+def measure(setup, run, seed, min_repeat, max_repeat, min_time):
+    times = []
+    while len(times) < min_repeat or (sum(times) < min_time and len(times) < max_repeat):
+        seed_all(seed)
+        state = setup()
+        start = time.perf_counter()
+        run(state)
+        times.append(time.perf_counter() - start)
+    return times
+
+def run_benchmark(name, args):
+    sweep, setup, run = BENCHMARKS[name]
+    values = args.sizes if sweep == 'size' else args.pop_sizes
+    results = []
+    for value in values:
+        result = {"benchmark": name, "sweep": sweep, "value": value,
+                  "board_size": value if sweep == 'size' else args.board_size,
+                  "pop_size": value if sweep == 'pop' else (args.pop_size if name.startswith('genetic') else None)}
+        if value > MAX_SIZE.get(name, value):
+            result["skipped"] = f"size > {MAX_SIZE[name]}"
+        else:
+            try:
+                times = measure(lambda: setup(value, args), run, args.seed, args.min_repeat, args.max_repeat, args.min_time)
+            except (ValueError, IndexError, RecursionError, MemoryError) as e:
+                result["error"] = f"{type(e).__name__}: {e}"
+            else:
+                result.update({"best": min(times), "median": float(np.median(times)), "repeat": len(times)})
+        results.append(result)
+        print(f"{name:24} {sweep}={value:<6} " + (f"{result['best'] * 1e3:12.4f} ms" if "best" in result else result.get("error", result.get("skipped"))))
+    return results
+
+# Local exponents d log(time) / d log(n) between neighbouring points of a sweep, n being the cells for size sweeps
+def scaling(results):
+    points = [(r["value"] ** 2 if r["sweep"] == 'size' else r["value"], r["value"], r["best"]) for r in results if "best" in r]
+    curve = []
+    linear_until = points[-1][1] if points else None
+    for (n1, value1, t1), (n2, value2, t2) in zip(points, points[1:]):
+        exponent = math.log(t2 / t1) / math.log(n2 / n1) if t1 > 0 and t2 > 0 else None
+        curve.append({"from": value1, "to": value2, "exponent": exponent})
+        if exponent is not None and exponent > SUPERLINEAR and linear_until == points[-1][1]:
+            linear_until = value1
+    return {"per": "cells" if results and results[0]["sweep"] == 'size' else "population", "curve": curve, "linear_until": linear_until}
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+# Speedup of this run over an old results file for every (benchmark, value) in both
+def compare(old_path, report):
+    with open(old_path) as f:
+        old = json.load(f)
+    old_best = {(r["benchmark"], r["value"]): r["best"] for r in old["results"] if "best" in r}
+    print(f"Compared to {old_path} (commit {old.get('commit')})")
+    for r in report["results"]:
+        key = (r["benchmark"], r["value"])
+        if "best" in r and key in old_best:
+            print(f"{r['benchmark']:24} {r['sweep']}={r['value']:<6} {old_best[key] / r['best']:8.2f}x")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--out", default="benchmark.json")  #  JSON file the results are written to
+    parser.add_argument("--compare", default=None)  #  Earlier results file to print the speedups against
+    parser.add_argument("--only", default=None)  #  Comma separated benchmarks to run, default all of them
+    parser.add_argument("--quick", action='store_true')  #  Small sweep only (sizes up to 32, populations up to 100)
+    parser.add_argument("--seed", default=1, type=int)  #  Seed of the boards and populations
+    parser.add_argument("--board-size", default=16, type=int)  #  Board size of the population sweeps
+    parser.add_argument("--pop-size", default=20, type=int)  #  Population size of the genetic_algorithm board size sweep
+    parser.add_argument("--generations", default=5, type=int)  #  Generations of every genetic_algorithm run
+    parser.add_argument("--min-time", default=0.2, type=float)  #  Seconds of timed runs per point
+    parser.add_argument("--min-repeat", default=3, type=int)  #  Timed runs per point at least
+    parser.add_argument("--max-repeat", default=1000, type=int)  #  Timed runs per point at most
+    args = parser.parse_args()
+    args.sizes = QUICK_SIZES if args.quick else SIZES
+    args.pop_sizes = QUICK_POP_SIZES if args.quick else POP_SIZES
+
+    names = args.only.split(',') if args.only else list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            parser.error(f"unknown benchmark {name!r}, choose from {', '.join(BENCHMARKS)}")
+
+    report = {"commit": git_commit(), "time": time.strftime('%Y-%m-%dT%H:%M:%S'), "python": platform.python_version(),
+              "numpy": np.__version__, "platform": platform.platform(),
+              "config": {key: value for key, value in vars(args).items() if key not in ('out', 'compare', 'only')},
+              "results": [], "scaling": {}}
+    for name in names:
+        results = run_benchmark(name, args)
+        report["results"].extend(results)
+        report["scaling"][name] = scaling(results)
+        print(f"{name:24} linear up to {report['scaling'][name]['linear_until']}")
+
+    with open(args.out, 'w') as f:
+        json.dump(report, f, indent=1)
+    print(f"Results = {args.out}")
+    if args.compare:
+        compare(args.compare, report)
@@ -0,0 +1,121 @@
+import json
+import os
+import random
+import time
+from multiprocessing import Pool
+import numpy as np
+from src.Gridworld.Gridworld import Gridworld, generate_boards
+from fuzzing import initialize_population, genetic_algorithm, decode_trace, spawn_rngs, StopCondition, Coverage
+from corpus import open_corpus_writer
+
+# Bulk trace generation: one (board mode, board size, seed) job per GA run, scheduled on a process pool.
+# Every finished job is appended to a JSONL checkpoint file so a killed campaign resumes with the jobs it has not finished.
+
+CORPUS_SUFFIX = {'jsonl': '.jsonl', 'binary': '.bin'}
+
+def job_key(mode, size, seed):
+    return f"{mode}-{size}-{seed}"
+
+def campaign_jobs(seeds, sizes, modes):
+    return [(mode, size, seed) for mode in modes for size in sizes for seed in seeds]
+
+# Keys of the jobs already recorded in the checkpoint. A line cut short by a kill is ignored, that job simply runs again.
+def load_checkpoint(path):
+    done = {}
+    if path and os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                try:
+                    result = json.loads(line)
+                except ValueError:
+                    continue
+                done[result["job"]] = result
+    return done
+
+# Run one GA on one board, the random streams are seeded from the job seed so a job gives the same result wherever it runs
+def run_job(job):
+    (mode, size, seed), config = job
+    start = time.time()
+    result = {"job": job_key(mode, size, seed), "mode": mode, "size": size, "seed": seed}
+    random.seed(seed)
+    np.random.seed(seed)
+    board_rng, population_rng = spawn_rngs(seed, 2)
+    try:
+        if mode == 'generated':
+            # Vectorized generator, always solvable
+            cells, player_pos = generate_boards(1, size, board_rng)
+            game = Gridworld.from_layout(cells[0], player_pos[0])
+        else:
+            game = Gridworld(size=size, mode=mode, rng=board_rng)
+        population = initialize_population(config["pop_size"], game, config["seeding"], population_rng)
+    except (ValueError, IndexError, RecursionError) as e:
+        # Board could not be generated or has no reachable goal
+        result["error"] = f"{type(e).__name__}: {e}"
+        result["seconds"] = time.time() - start
+        return result
+
+    stop = StopCondition(config.get("deadline"), config.get("plateau", 0), config.get("target_fitness"))
+    coverage = Coverage(game, config.get("coverage_weight", 1.0)) if config.get("coverage") else None
+    writer = None
+    if config["corpus_dir"]:
+        writer = open_corpus_writer(os.path.join(config["corpus_dir"], result["job"] + CORPUS_SUFFIX[config["corpus_format"]]), config["corpus_format"])
+    try:
+        max_fitness, max_fitness_trace, max_fitness_trial, generational_stats, _, _, _ = \
+            genetic_algorithm(population, game, config["generations"], config["crossover"], config["mutation"], [], 0, on_generation=writer,
+                              selection=config.get("selection", 'roulette'), replacement=config.get("replacement", 'steady'), offspring=config.get("offspring", 0), stop=stop, coverage=coverage)
+    finally:
+        if writer is not None:
+            writer.close()
+
+    result["max_fitness"] = max_fitness
+    result["reaches_goal"] = max_fitness_trial["reaches_goal"]
+    result["max_fitness_trace"] = ''.join(decode_trace(max_fitness_trace))
+    result["generations"] = len(generational_stats)
+    result["stop_reason"] = stop.reason
+    if coverage is not None:
+        result["coverage"] = coverage.stats()
+    result["seconds"] = time.time() - start
+    return result
+
+# Run every job of the campaign that is not in the checkpoint yet on workers processes.
+# Returns the results of all jobs (including the ones from the checkpoint) and the aggregate stats of this run.
+def run_campaign(jobs, config, workers=1, checkpoint=None, progress=print):
+    done = load_checkpoint(checkpoint)
+    pending = [job for job in jobs if job_key(*job) not in done]
+    if config["corpus_dir"]:
+        os.makedirs(config["corpus_dir"], exist_ok=True)
+    progress(f"Campaign: {len(jobs)} jobs, {len(jobs) - len(pending)} already done, {len(pending)} to run on {workers} workers")
+
+    start = time.time()
+    completed = failed = 0
+    out = open(checkpoint, 'a') if checkpoint else None
+    try:
+        with Pool(workers) as pool:
+            for result in pool.imap_unordered(run_job, [(job, config) for job in pending]):
+                done[result["job"]] = result
+                if out is not None:
+                    out.write(json.dumps(result) + '\n')
+                    out.flush()
+                    os.fsync(out.fileno())
+                completed += 1
+                if "error" in result:
+                    failed += 1
+                elapsed = time.time() - start
+                progress(f"[{completed}/{len(pending)}] {result['job']} " +
+                         (result["error"] if "error" in result else f"max_fitness={result['max_fitness']}") +
+                         f" ({60 * completed / elapsed:.1f} boards/min)")
+    finally:
+        if out is not None:
+            out.close()
+
+    elapsed = time.time() - start
+    stats = {"jobs": len(jobs), "skipped": len(jobs) - len(pending), "completed": completed, "failed": failed,
+             "seconds": elapsed, "boards_per_minute": 60 * completed / elapsed if elapsed else 0.0}
+    return [done[job_key(*job)] for job in jobs if job_key(*job) in done], stats
+
+# "1:100" -> seeds 1..99, "1,5,9" -> those seeds
+def parse_seeds(spec):
+    if ':' in spec:
+        start, end = spec.split(':')
+        return list(range(int(start), int(end)))
+    return [int(seed) for seed in spec.split(',')]
@@ -0,0 +1,152 @@
+import json
+import mmap
+import os
+import struct
+import numpy as np
+from fuzzing import decode_trace, pack_trace, unpack_trace
+
+# Trace corpora written while genetic_algorithm runs, one record per evaluated trace of every generation.
+# Each record holds the generation, the index of the trace in it, the trace (the moves actually taken) and the trial metrics.
+#
+# JSONL: one JSON object per line, the trace as a 'udlr' string.
+# Binary: the data file starts with MAGIC and is followed by records of RECORD header + 2-bit packed trace,
+# the path + '.idx' file holds the uint64 offset of every record so a reader can mmap both and seek to any trace.
+#
+# position() is where a writer is (stored in GA checkpoints), a writer opened with that position truncates the file to
+# it and appends from there, so a resumed run carries on the corpus of the run it resumes.
+
+MAGIC = b'IFTRACE1'
+# generation, index, trace length, boundary_states, illegal_moves, bad_states, fitness, reaches_goal
+RECORD = struct.Struct('<IIIIIIdB')
+
+class JsonlCorpusWriter:
+    format = 'jsonl'
+
+    def __init__(self, path, position=None):
+        self.path = path
+        if position is None:
+            self.file = open(path, 'w')
+            self.records = 0
+        else:
+            os.truncate(path, position["offset"])
+            self.file = open(path, 'a')
+            self.records = position["records"]
+
+    def position(self):
+        return {"path": os.path.abspath(self.path), "format": self.format, "records": self.records, "offset": self.file.tell()}
+
+    def write_generation(self, generation, trials):
+        lines = []
+        for index, trial in enumerate(trials):
+            record = {"generation": generation, "index": index,
+                      "trace": ''.join(decode_trace(trial["actual_path"])),
+                      "boundary_states": trial["boundary_states"], "illegal_moves": trial["illegal_moves"],
+                      "bad_states": trial["bad_states"], "reaches_goal": trial["reaches_goal"], "fitness": trial["fitness"]}
+            lines.append(json.dumps(record))
+        if lines:
+            self.file.write('\n'.join(lines) + '\n')
+        self.file.flush()
+        self.records += len(lines)
+
+    # Can be passed as on_generation to genetic_algorithm
+    def __call__(self, generation, trials):
+        self.write_generation(generation, trials)
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class BinaryCorpusWriter(JsonlCorpusWriter):
+    format = 'binary'
+
+    def __init__(self, path, position=None):
+        self.path = path
+        if position is None:
+            self.file = open(path, 'wb')
+            self.index_file = open(path + '.idx', 'wb')
+            self.file.write(MAGIC)
+            self.offset = len(MAGIC)
+            self.records = 0
+        else:
+            os.truncate(path, position["offset"])
+            os.truncate(path + '.idx', position["records"] * 8)
+            self.file = open(path, 'ab')
+            self.index_file = open(path + '.idx', 'ab')
+            self.offset = position["offset"]
+            self.records = position["records"]
+
+    def write_generation(self, generation, trials):
+        chunks = []
+        offsets = np.empty(len(trials), dtype='<u8')
+        for index, trial in enumerate(trials):
+            path = trial["actual_path"]
+            chunks.append(RECORD.pack(generation, index, len(path), trial["boundary_states"], trial["illegal_moves"],
+                                      trial["bad_states"], trial["fitness"], trial["reaches_goal"]))
+            chunks.append(pack_trace(path))
+            offsets[index] = self.offset
+            self.offset += RECORD.size + (len(path) + 3) // 4
+        self.file.write(b''.join(chunks))
+        self.index_file.write(offsets.tobytes())
+        self.file.flush()
+        self.index_file.flush()
+        self.records += len(trials)
+
+    def close(self):
+        self.file.close()
+        self.index_file.close()
+
+def open_corpus_writer(path, corpus_format='jsonl', position=None):
+    if corpus_format == 'jsonl':
+        return JsonlCorpusWriter(path, position)
+    elif corpus_format == 'binary':
+        return BinaryCorpusWriter(path, position)
+    raise ValueError(f"Unknown corpus format {corpus_format!r}")
+
+# Memory-mapped reader of a binary corpus, corpus[i] decodes only the i-th record.
+# Records have the JSONL schema, the trace as a 'udlr' string (encode_trace turns it back into move codes).
+class CorpusReader:
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.data[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a binary trace corpus")
+        if os.path.getsize(path + '.idx'):
+            with open(path + '.idx', 'rb') as f:
+                self.index_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.offsets = np.frombuffer(self.index_map, dtype='<u8')
+        else:
+            self.index_map = None
+            self.offsets = np.empty(0, dtype='<u8')
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, i):
+        offset = int(self.offsets[i])
+        generation, index, length, boundary_states, illegal_moves, bad_states, fitness, reaches_goal = RECORD.unpack_from(self.data, offset)
+        start = offset + RECORD.size
+        return {"generation": generation, "index": index,
+                "trace": ''.join(decode_trace(unpack_trace(self.data[start:start + (length + 3) // 4], length))),
+                "boundary_states": boundary_states, "illegal_moves": illegal_moves, "bad_states": bad_states,
+                "reaches_goal": bool(reaches_goal), "fitness": fitness}
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def close(self):
+        self.offsets = None
+        if self.index_map is not None:
+            self.index_map.close()
+        self.data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -2,43 +2,122 @@ from src.Gridworld.Gridworld import *
 import argparse
 import random
 from fuzzing import *
+from corpus import open_corpus_writer
+from metrics import MetricsLog, profiled
+from campaign import campaign_jobs, parse_seeds, run_campaign
+import os
 from copy import copy, deepcopy
      
 
+# Arguments that may differ between a run and its resume, all the others are taken from the checkpoint
+RUN_ONLY_ARGS = {'resume', 'checkpoint', 'checkpoint_interval', 'workers', 'chunk_size', 'prefix_cache', 'corpus',
+                 'corpus_format', 'coverage_corpus', 'metrics_log', 'profile', 'profile_out'}
+
+# Where the output name was when the resumed checkpoint was taken, if this run writes it to the same file in the same
+# format: the file is then truncated to that point and appended to. Other outputs are started over.
+def output_position(resume, name, path, output_format):
+    position = resume["outputs"].get(name) if resume is not None else None
+    if position is not None and position["path"] == os.path.abspath(path) and position["format"] == output_format:
+        return position
+    return None
+
+# Flags a run mode does not use, given together with it they are an error instead of being silently dropped
+UNSUPPORTED_ARGS = {
+    'campaign': ('islands', 'size', 'seed', 'random', 'sparse', 'num_walls', 'num_pits', 'chunk_size', 'prefix_cache',
+                 'corpus', 'coverage_corpus', 'metrics_log', 'resume'),
+    'islands': ('workers', 'chunk_size', 'prefix_cache', 'corpus', 'coverage', 'coverage_corpus', 'metrics_log',
+                'checkpoint', 'deadline', 'plateau', 'target_fitness', 'resume'),
+}
+
+# Sparse boards are too large to print, only their piece counts are shown
+def show_board(game):
+    if game.board.sparse:
+        board = game.board
+        print(f"Sparse board {board.size}x{board.size}: player {board.components['Player'].pos}, {len(board.components['Walls'])} walls, "
+              f"{len(board.components['Pits'])} pits, {len(board.components['Goals'])} goals, {len(board.visits)} cells on the path")
+    else:
+        game.dispGrid()
+
 # Create Traces.
 def play(args):
+    resume = None
+    if args.resume:
+        resume = load_ga_state(args.resume)
+        vars(args).update({key: value for key, value in resume["config"].items() if key not in RUN_ONLY_ARGS})
 
     random.seed(args.seed)
+    # The board and the initial population have their own streams of the seed, the GA operators use the random module
+    board_rng, population_rng = spawn_rngs(args.seed, 2)
     if args.random:
-        game = Gridworld(size=args.size, mode='random')
+        game = Gridworld(size=args.size, mode='random', sparse=args.sparse, rng=board_rng, num_walls=args.num_walls, num_pits=args.num_pits)
     else:
-        game = Gridworld(size=args.size, mode='static')
-    game.dispGrid()
+        game = Gridworld(size=args.size, mode='static', sparse=args.sparse, rng=board_rng)
+    show_board(game)
 
 
 
-    generational_stats = []
-    population = initialize_population(args.pop_size, game)
+    if args.islands > 1:
+        play_islands(args, game, population_rng)
+        return
 
-    max_fitness, max_fitness_trace, max_fitness_trial, generational_stats, population, final_fitness, final_population = \
-        genetic_algorithm(population, game, args.generations, args.crossover, args.mutation, generational_stats, 0)
+    if resume is None:
+        generational_stats = []
+        population = initialize_population(args.pop_size, game, args.seeding, population_rng)
+        generations, gen_count = args.generations, 0
+    else:
+        # The random state is restored by genetic_algorithm, the game above is rebuilt from the same seed
+        generational_stats, population = resume["generational_stats"], resume["population"]
+        generations, gen_count = resume["max_generation"], resume["gen_count"]
+        print(f"Resume = {args.resume} (generation {gen_count}, {generations} to go)")
+    cache = PrefixCache(game, args.prefix_cache) if args.prefix_cache else None
+    # Stream every generation to the corpus file instead of printing the populations at the end
+    writer = open_corpus_writer(args.corpus, args.corpus_format, output_position(resume, 'corpus', args.corpus, args.corpus_format)) if args.corpus else None
+    metrics_log = MetricsLog(args.metrics_log, output_position(resume, 'metrics_log', args.metrics_log, MetricsLog.format)) if args.metrics_log else None
+    coverage_writer = open_corpus_writer(args.coverage_corpus, args.corpus_format,
+                                         output_position(resume, 'coverage_corpus', args.coverage_corpus, args.corpus_format)) if args.coverage_corpus else None
+    coverage = Coverage(game, args.coverage_weight, coverage_writer) if args.coverage else None
+    stop = StopCondition(args.deadline, args.plateau, args.target_fitness)
+    outputs = {name: output for name, output in (('corpus', writer), ('metrics_log', metrics_log), ('coverage_corpus', coverage_writer)) if output is not None}
+    checkpoint = GACheckpoint(args.checkpoint, args.checkpoint_interval,
+                              {key: value for key, value in vars(args).items() if key not in RUN_ONLY_ARGS}, outputs) if args.checkpoint else None
+
+    try:
+        max_fitness, max_fitness_trace, max_fitness_trial, generational_stats, population, final_fitness, final_population = \
+            genetic_algorithm(population, game, generations, args.crossover, args.mutation, generational_stats, gen_count,
+                              workers=args.workers, chunk_size=args.chunk_size, cache=cache, on_generation=writer, selection=args.selection,
+                              replacement=args.replacement, offspring=args.offspring, on_metrics=metrics_log, stop=stop, checkpoint=checkpoint, resume=resume, coverage=coverage)
+    finally:
+        if writer is not None:
+            writer.close()
+        if metrics_log is not None:
+            metrics_log.close()
+        if coverage_writer is not None:
+            coverage_writer.close()
     
     print(f"Max_Fitness = {max_fitness}")
+    print(f"Stop = {stop.stats()}")
     #for stat in generational_stats:
     #    print(stat)
-    print(f"Population: {population}")
-    print(f"Final_Population: {final_population}")
-    print(f"Final_Fitness: {final_fitness}")
-    print(f"Final_Fitness: {final_fitness}")
-
-    print(f"Max_Fitness_Trial = {max_fitness_trial}")
-    print(f"Max_Fitness_Trace = {max_fitness_trace}")
+    if writer is None:
+        print(f"Population: {[decode_trace(trace) for trace in population]}")
+        print(f"Final_Population: {[decode_trace(trace) for trace in final_population]}")
+        print(f"Final_Fitness: {final_fitness}")
+        print(f"Final_Fitness: {final_fitness}")
+    else:
+        print(f"Corpus = {args.corpus} ({writer.records} traces)")
+
+    print(f"Max_Fitness_Trial = {decode_trial(max_fitness_trial)}")
+    print(f"Max_Fitness_Trace = {decode_trace(max_fitness_trace)}")
+    if cache is not None:
+        print(f"Prefix_Cache = {cache.stats()}")
+    if coverage is not None:
+        print(f"Coverage = {coverage.stats()}")
     
 
     # Play out the winning scenaro
-    for move in max_fitness_trace:
+    for move in decode_trace(max_fitness_trace):
         game.makeMove(move)
-    game.dispGrid()
+    show_board(game)
     
 
     
@@ -47,6 +126,36 @@ def play(args):
 
 
         
+# Evolve args.islands populations of args.pop_size in parallel with migration between them
+def play_islands(args, game, rng):
+    populations = [initialize_population(args.pop_size, game, args.seeding, island_rng) for island_rng in spawn_rngs(rng, args.islands)]
+    max_fitness, max_fitness_trace, max_fitness_trial, island_stats, populations = \
+        island_genetic_algorithm(populations, game, args.generations, args.crossover, args.mutation, args.migration_interval,
+                                 selection=args.selection, replacement=args.replacement, offspring=args.offspring)
+
+    print(f"Max_Fitness = {max_fitness}")
+    for island, stats in enumerate(island_stats):
+        print(f"Island {island} Max_Fitness = {max(stat[0] for stat in stats)}")
+    print(f"Max_Fitness_Trial = {decode_trial(max_fitness_trial)}")
+    print(f"Max_Fitness_Trace = {decode_trace(max_fitness_trace)}")
+
+    for move in decode_trace(max_fitness_trace):
+        game.makeMove(move)
+    show_board(game)
+
+# Run the GA on every (mode, size, seed) of the campaign, --workers jobs at a time, resuming from --checkpoint
+def play_campaign(args):
+    jobs = campaign_jobs(parse_seeds(args.seeds), [int(size) for size in args.sizes.split(',')], args.modes.split(','))
+    config = {"pop_size": args.pop_size, "seeding": args.seeding, "generations": args.generations, "crossover": args.crossover,
+              "mutation": args.mutation, "selection": args.selection,
+              "replacement": args.replacement, "offspring": args.offspring,
+              "deadline": args.deadline, "plateau": args.plateau, "target_fitness": args.target_fitness,
+              "coverage": args.coverage, "coverage_weight": args.coverage_weight, "corpus_dir": args.corpus_dir, "corpus_format": args.corpus_format}
+    results, stats = run_campaign(jobs, config, max(args.workers, 1) if args.workers else os.cpu_count(), args.checkpoint)
+
+    solved = sum(1 for result in results if result.get("reaches_goal"))
+    print(f"Campaign_Stats = {stats}")
+    print(f"Solved = {solved}/{len(results)}")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -59,8 +168,49 @@ if __name__ == "__main__":
     parser.add_argument("--mutation", default=.1, type=float)  #  Set the mutation probability
     parser.add_argument("--pop-size", default=4, type=int)  #  Set the size of the initial population. Must be at least 4.
     parser.add_argument("--random", action='store_true')  #  Store random
+    parser.add_argument("--sparse", action='store_true')  #  Keep the board cells in dicts instead of size x size arrays, for large boards with few pieces
+    parser.add_argument("--num-walls", default=None, type=int)  #  Walls of a --random board, default size*size/10
+    parser.add_argument("--num-pits", default=None, type=int)  #  Pits of a --random board, default size*size/20
+    parser.add_argument("--selection", default='roulette', choices=['roulette', 'rank', 'tournament'])  #  Parent selection method
+    parser.add_argument("--replacement", default='steady', choices=REPLACEMENTS)  #  How the next generation replaces the current one
+    parser.add_argument("--offspring", default=0, type=int)  #  Children per generation for mu+lambda, 0 uses the population size
+    parser.add_argument("--deadline", default=None, type=float)  #  Stop the GA after this many seconds (campaign: per job)
+    parser.add_argument("--plateau", default=0, type=int)  #  Stop the GA when the max fitness has not improved for this many generations, 0 never
+    parser.add_argument("--target-fitness", default=None, type=float)  #  Stop the GA once the max fitness reaches this
+    parser.add_argument("--coverage", action='store_true')  #  Coverage-guided fitness: bonus for traces reaching new (cell, action) transitions or boundary cells
+    parser.add_argument("--coverage-weight", default=1.0, type=float)  #  Fitness bonus per newly covered transition or boundary cell
+    parser.add_argument("--coverage-corpus", default=None)  #  File the coverage-increasing traces are written to (in --corpus-format)
+    parser.add_argument("--seeding", default='dfs', choices=['dfs', 'shortest'])  #  Seed traces of the population: directional DFS or shortest paths
+    parser.add_argument("--workers", default=0, type=int)  #  Number of processes evaluating fitness, 0 or 1 evaluates serially (campaign: job processes, 0 uses every core)
+    parser.add_argument("--chunk-size", default=0, type=int)  #  Traces per work item sent to a worker, 0 splits the population evenly
+    parser.add_argument("--prefix-cache", default=0, type=int)  #  Max nodes (32 moves each) of the prefix trie reusing simulated prefixes, 0 disables it
+    parser.add_argument("--corpus", default=None)  #  File the traces and trials of every generation are streamed to
+    parser.add_argument("--corpus-format", default='jsonl', choices=['jsonl', 'binary'])  #  Corpus format, binary has an offset index for random access
+    parser.add_argument("--islands", default=1, type=int)  #  Number of island populations evolved in parallel processes, 1 runs a single population
+    parser.add_argument("--migration-interval", default=10, type=int)  #  Generations between elite exchanges of the islands
+    parser.add_argument("--campaign", action='store_true')  #  Run a campaign over --seeds x --sizes x --modes instead of a single board
+    parser.add_argument("--seeds", default="1:11")  #  Campaign seeds, a start:end range or a comma separated list
+    parser.add_argument("--sizes", default="8")  #  Campaign board sizes, comma separated
+    parser.add_argument("--modes", default="random")  #  Campaign board modes, comma separated (static, player, random, generated)
+    parser.add_argument("--checkpoint", default=None)  #  Campaign: file of finished jobs that are skipped. Single run: file the GA state is saved to
+    parser.add_argument("--checkpoint-interval", default=10, type=int)  #  Generations between GA state checkpoints
+    parser.add_argument("--resume", default=None)  #  GA state checkpoint to carry on from, the board and GA settings are taken from it
+    parser.add_argument("--corpus-dir", default=None)  #  Directory the campaign writes one corpus per job to
+    parser.add_argument("--metrics-log", default=None)  #  JSONL file of per generation metrics (phase times, evals/s, memory, unique genes)
+    parser.add_argument("--profile", default=None, choices=['cprofile', 'sample'])  #  Profile the run with cProfile or the sampling profiler
+    parser.add_argument("--profile-out", default='profile.out')  #  File the profile is written to (pstats or collapsed stacks)
 
     args = parser.parse_args()
+    mode = 'campaign' if args.campaign else 'islands' if args.islands > 1 else None
+    for dest in UNSUPPORTED_ARGS.get(mode, ()):
+        if getattr(args, dest) != parser.get_default(dest):
+            parser.error(f"--{dest.replace('_', '-')} is not supported with --{mode}")
+    if args.prefix_cache and args.workers > 1 and not args.campaign:
+        parser.error("--prefix-cache evaluates in the main process, it cannot be combined with --workers")
 
     # Train 
-    play(args)
+    with profiled(args.profile, args.profile_out):
+        if args.campaign:
+            play_campaign(args)
+        else:
+            play(args)
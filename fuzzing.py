@@ -1,23 +1,92 @@
-from copy import copy, deepcopy
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from multiprocessing import Pool
+from queue import Queue, Empty, Full
+import asyncio
+import json
+import os
 import random
-def get_fitness(game, trace):
+import sys
+import threading
+import time
+import numpy as np
+from src.Gridworld.Gridworld import WALL, PIT, GOAL, SparseCells
+
+# Replacement strategies of genetic_algorithm
+REPLACEMENTS = ('steady', 'generational', 'mu+lambda')
+
+# Row/col offset of each move
+MOVES = {'u': (-1, 0), 'd': (1, 0), 'l': (0, -1), 'r': (0, 1)}
+
+# Traces are bytearrays of move codes (one uint8 per move), any other code is an illegal no-op.
+# encode_trace/decode_trace convert from/to the ['u', 'd', 'l', 'r'] form used for display.
+MOVE_NAMES = 'udlr'
+MOVE_CODES = {'u': 0, 'd': 1, 'l': 2, 'r': 3}
+MOVE_OFFSETS = tuple(MOVES[move] for move in MOVE_NAMES)
+NOOP = len(MOVE_CODES)
+_CODE_OF_BYTE = np.full(256, NOOP, dtype=np.uint8)
+for _move, _code in MOVE_CODES.items():
+    _CODE_OF_BYTE[ord(_move)] = _code
+
+def encode_trace(moves):
+    if isinstance(moves, bytearray):
+        return moves
+    if isinstance(moves, bytes):
+        return bytearray(moves)
+    if isinstance(moves, np.ndarray) and moves.dtype.kind in 'iu':
+        # Arrays of move codes are converted value by value, their raw bytes are only codes for uint8
+        if moves.size and (moves.min() < 0 or moves.max() > 255):
+            raise ValueError("Move codes must be in 0..255")
+        return bytearray(moves.astype(np.uint8).tobytes())
+    if isinstance(moves, np.ndarray) and moves.dtype.kind not in 'US':
+        raise TypeError(f"Cannot encode a trace from an array of {moves.dtype}")
+    return bytearray(_CODE_OF_BYTE[np.frombuffer(''.join(moves).encode('latin-1'), dtype=np.uint8)].tobytes())
+
+def decode_trace(trace):
+    return [MOVE_NAMES[code] if code < NOOP else '?' for code in trace]
+
+# Display form of a trial, with the actual path decoded
+def decode_trial(trial):
+    trial = dict(trial)
+    trial["actual_path"] = decode_trace(trial["actual_path"])
+    return trial
+
+# 2-bit packed form of a trace for storage, four moves per byte (the length has to be stored separately)
+def pack_trace(trace):
+    codes = np.frombuffer(bytes(trace), dtype=np.uint8) & 3
+    codes = np.concatenate([codes, np.zeros(-len(codes) % 4, dtype=np.uint8)]).reshape(-1, 4)
+    return (codes[:, 0] | (codes[:, 1] << 2) | (codes[:, 2] << 4) | (codes[:, 3] << 6)).astype(np.uint8).tobytes()
+
+def unpack_trace(packed, length):
+    packed = np.frombuffer(packed, dtype=np.uint8)
+    codes = np.stack([packed & 3, (packed >> 2) & 3, (packed >> 4) & 3, packed >> 6], axis=1).ravel()
+    return bytearray(codes[:length].tobytes())
+
+def new_trial():
     trial = {}
     trial["boundary_states"] = 0
     trial["illegal_moves"] = 0
     trial["bad_states"] = 0
     trial["reaches_goal"] = False
-    trial["actual_path"] = []
+    trial["actual_path"] = bytearray()
     trial["fitness"] = 0
+    return trial
+
+# Let fitness be a function of the number of boundary states we get to without going to bad state. Reward for getting to goal. Penalize for not.
+def score_trial(trial, size):
+    ratio_of_boundary_states = (trial["boundary_states"] / trial["bad_states"]) if trial["bad_states"] else trial["boundary_states"]
+    trial["fitness"] +=  ratio_of_boundary_states + ((size*size) if trial["reaches_goal"] else 1)
+    return trial
+
+def get_fitness(game, trace):
+    trial = new_trial()
+    boundary = game.boundary_mask()
 
-    for move in trace:
-        moved = game.makeMove(move)
+    for move in encode_trace(trace):
+        moved = game.makeMove(MOVE_NAMES[move] if move < NOOP else None)
         player_pos = game.board.components['Player'].pos
-        up = player_pos[0]-1, player_pos[1]
-        down = player_pos[0]+1, player_pos[1]
-        left = player_pos[0], player_pos[1]-1
-        right = player_pos[0], player_pos[1]+1
         # If first time being in this state and there is a pit around it
-        if (game.is_pit(up) or game.is_pit(down) or game.is_pit(left) or game.is_pit(right)) and moved:
+        if moved and boundary[player_pos]:
             trial["boundary_states"] += 1 
 
         if game.is_pit(player_pos):
@@ -31,65 +100,476 @@ def get_fitness(game, trace):
             trial["reaches_goal"] = True
             break
 
-    
-    # Let fitness be a function of the number of boundary states we get to without going to bad state. Reward for getting to goal. Penalize for not.
-    ratio_of_boundary_states = (trial["boundary_states"] / trial["bad_states"]) if trial["bad_states"] else trial["boundary_states"]
-    trial["fitness"] +=  ratio_of_boundary_states + ((game.board.size*game.board.size) if trial["reaches_goal"] else 1)
+    return score_trial(trial, game.board.size)
 
-    return trial
+# Same result as get_fitness(deepcopy(game), trace) but without copying or moving anything on the game.
+# The board layout is only read, the player position and the counters are the only state that changes.
+def simulate(game, trace):
+    trial = new_trial()
+    cells = game.board.cells
+    boundary = game.boundary_mask()
+    size = game.board.size
+    row, col = game.board.components['Player'].pos
+    actual_path = trial["actual_path"]
+    boundary_states = bad_states = illegal_moves = 0
+
+    for move in encode_trace(trace):
+        moved = False
+        if move < NOOP:
+            offset = MOVE_OFFSETS[move]
+            new_row = row + offset[0]
+            new_col = col + offset[1]
+            if 0 <= new_row < size and 0 <= new_col < size and not cells[new_row, new_col] & WALL:
+                row, col = new_row, new_col
+                moved = True
+
+        flags = cells[row, col]
+        if moved:
+            # If there is a pit around the new state
+            if boundary[row, col]:
+                boundary_states += 1
+            actual_path.append(move)
+        else:
+            illegal_moves += 1
+        if flags & PIT:
+            bad_states += 1
+        if flags & GOAL:
+            trial["reaches_goal"] = True
+            break
+
+    trial["boundary_states"] = boundary_states
+    trial["bad_states"] = bad_states
+    trial["illegal_moves"] = illegal_moves
+    trial["fitness"] = len(actual_path) # Reward exploration and making good moves
+    return score_trial(trial, size)
+
+# Precompute the tables the batched evaluator steps through, cells are flattened to row*size+col.
+# next_cell[cell, action] is where the player ends up (itself when the move is illegal),
+# legal[cell, action] says if the move was made, the masks are per cell. Sparse boards get lookups standing in for them.
+def board_tables(game):
+    if game.board.sparse:
+        return sparse_board_tables(game)
+    board = game.board
+    size = board.size
+    cells = board.cells
+    rows, cols = np.divmod(np.arange(size*size), size)
+    next_cell = np.repeat(np.arange(size*size)[:, None], NOOP+1, axis=1)
+    legal = np.zeros((size*size, NOOP+1), dtype=bool)
+    for move, code in MOVE_CODES.items():
+        new_rows = rows + MOVES[move][0]
+        new_cols = cols + MOVES[move][1]
+        on_board = (new_rows >= 0) & (new_rows < size) & (new_cols >= 0) & (new_cols < size)
+        target = np.where(on_board, new_rows*size + new_cols, 0)
+        ok = on_board & ((cells.ravel()[target] & WALL) == 0)
+        legal[:, code] = ok
+        next_cell[ok, code] = target[ok]
+
+    pit = (cells & PIT) != 0
+    return next_cell, legal, pit.ravel(), ((cells & GOAL) != 0).ravel(), game.boundary_mask().ravel()
+
+# Sparse stand-ins for the per-cell tables of board_tables, computed for each lookup from sorted cell ids.
+# _SortedIds[cells] is the membership of an array of cell ids (assigning True/False adds/removes them, like bitmap bits),
+# _SparseMoves[cells, actions] the next cell of each move (target=True) or whether it is legal.
+class _SortedIds:
+    def __init__(self, ids):
+        self.ids = ids
+
+    def __getitem__(self, cells):
+        if not len(self.ids):
+            return np.zeros(np.shape(cells), dtype=bool)
+        return self.ids[np.minimum(np.searchsorted(self.ids, cells), len(self.ids) - 1)] == cells
+
+    def __setitem__(self, cells, value):
+        self.ids = np.union1d(self.ids, cells) if value else np.setdiff1d(self.ids, cells)
+
+_ROW_OFFSETS = np.array([offset[0] for offset in MOVE_OFFSETS] + [0], dtype=np.int64)
+_COL_OFFSETS = np.array([offset[1] for offset in MOVE_OFFSETS] + [0], dtype=np.int64)
 
-# DFS Traversal to get a winning path.
-def get_first_trace(game, preference_order='u'): # preference order is what node to explore first.
+class _SparseMoves:
+    def __init__(self, size, walls, target):
+        self.size = size
+        self.walls = walls
+        self.target = target
+
+    def __getitem__(self, key):
+        cells, actions = key
+        rows, cols = np.divmod(cells, self.size)
+        new_rows = rows + _ROW_OFFSETS[actions]
+        new_cols = cols + _COL_OFFSETS[actions]
+        ok = (actions < NOOP) & (new_rows >= 0) & (new_rows < self.size) & (new_cols >= 0) & (new_cols < self.size)
+        target = np.where(ok, new_rows*self.size + new_cols, cells)
+        ok &= ~self.walls[target]
+        return np.where(ok, target, cells) if self.target else ok
+
+def sparse_board_tables(game):
+    cells = game.board.cells
+    walls = _SortedIds(cells.ids(WALL))
+    return (_SparseMoves(game.board.size, walls, True), _SparseMoves(game.board.size, walls, False),
+            _SortedIds(cells.ids(PIT)), _SortedIds(cells.ids(GOAL)), _SortedIds(game.boundary_mask().ids()))
+
+# Traces still running when fewer than this many are left are finished one at a time: a lockstep step costs the same
+# dozen array operations however few rows it moves, which is slower than simulating those rows move by move
+BATCH_MIN = 16
+
+# Concatenate a population of move lists into one flat array of move codes plus the start and length of every trace
+def pack_population(population):
+    lengths = np.fromiter((len(trace) for trace in population), dtype=np.int64, count=len(population))
+    starts = np.zeros(len(population), dtype=np.int64)
+    np.cumsum(lengths[:-1], out=starts[1:])
+    actions = np.frombuffer(b''.join(encode_trace(trace) for trace in population), dtype=np.uint8).copy()
+    np.minimum(actions, NOOP, out=actions)
+    return actions, starts, lengths
+
+# Step the packed traces from their start cells pos with the counters boundary, bad and illegal (all updated in place).
+# Only the rows still running are stepped, finished rows are compacted away, so the work is the total number of moves
+# made rather than population x longest trace. Returns reached, the moves made per row and taken[i] for every move i of
+# actions. With record the cell, near-pit and pit flags after every move made are kept as well (for the PrefixCache).
+def step_packed(game, tables, actions, starts, lengths, pos, boundary, bad, illegal, record=False):
+    next_cell, legal, pit, goal, near_pit = tables
+    num = len(lengths)
+    reached = np.zeros(num, dtype=bool)
+    ran = np.zeros(num, dtype=np.int64)
+    taken = np.zeros(len(actions), dtype=bool)
+    steps = (np.zeros(len(actions), dtype=np.int64), np.zeros(len(actions), dtype=bool), np.zeros(len(actions), dtype=bool)) if record else None
+
+    rows = np.flatnonzero(lengths > 0)
+    row_pos, row_boundary, row_bad, row_illegal = pos[rows], boundary[rows], bad[rows], illegal[rows]
+    t = 0
+    while len(rows) >= BATCH_MIN:
+        index = starts[rows] + t
+        action = actions[index]
+        moved = legal[row_pos, action]
+        row_pos = np.where(moved, next_cell[row_pos, action], row_pos)
+        near, in_pit, at_goal = near_pit[row_pos], pit[row_pos], goal[row_pos]
+        taken[index] = moved
+        if record:
+            steps[0][index] = row_pos
+            steps[1][index] = near
+            steps[2][index] = in_pit
+        row_boundary += moved & near
+        row_bad += in_pit
+        row_illegal += ~moved
+        t += 1
+        finished = at_goal | (lengths[rows] <= t)
+        if finished.any():
+            done = rows[finished]
+            pos[done], boundary[done], bad[done], illegal[done] = row_pos[finished], row_boundary[finished], row_bad[finished], row_illegal[finished]
+            reached[done] = at_goal[finished]
+            ran[done] = t
+            keep = ~finished
+            rows, row_pos, row_boundary, row_bad, row_illegal = rows[keep], row_pos[keep], row_boundary[keep], row_bad[keep], row_illegal[keep]
+
+    # The few long traces left (typically the DFS seeds) are finished like simulate does
+    cells = game.board.cells
+    near_mask = game.boundary_mask()
+    size = game.board.size
+    for i, cell, boundary_states, bad_states, illegal_moves in zip(rows.tolist(), row_pos.tolist(), row_boundary.tolist(), row_bad.tolist(), row_illegal.tolist()):
+        row, col = divmod(cell, size)
+        first = int(starts[i]) + t
+        moves = actions[first:int(starts[i] + lengths[i])].tolist()
+        moved_list, cell_list, near_list, pit_list = [], [], [], []
+        goal_reached = False
+        for move in moves:
+            moved = False
+            if move < NOOP:
+                offset = MOVE_OFFSETS[move]
+                new_row = row + offset[0]
+                new_col = col + offset[1]
+                if 0 <= new_row < size and 0 <= new_col < size and not cells[new_row, new_col] & WALL:
+                    row, col = new_row, new_col
+                    moved = True
+            flags = cells[row, col]
+            near = bool(near_mask[row, col])
+            moved_list.append(moved)
+            if record:
+                cell_list.append(row*size + col)
+                near_list.append(near)
+                pit_list.append(bool(flags & PIT))
+            if moved:
+                boundary_states += near
+            else:
+                illegal_moves += 1
+            if flags & PIT:
+                bad_states += 1
+            if flags & GOAL:
+                goal_reached = True
+                break
+        end = first + len(moved_list)
+        taken[first:end] = moved_list
+        if record:
+            steps[0][first:end] = cell_list
+            steps[1][first:end] = near_list
+            steps[2][first:end] = pit_list
+        pos[i], boundary[i], bad[i], illegal[i] = row*size + col, boundary_states, bad_states, illegal_moves
+        reached[i] = goal_reached
+        ran[i] = end - int(starts[i])
+    return reached, ran, taken, steps
+
+# Batched version of simulate: the traces of the population are stepped together as array operations.
+# Returns the same list of trials simulate would, one per trace.
+def evaluate_population(game, population, tables=None):
+    if not population:
+        return []
+    tables = tables if tables is not None else board_tables(game)
+    size = game.board.size
+    actions, starts, lengths = pack_population(population)
+    num = len(population)
+    start = game.board.components['Player'].pos
+    pos = np.full(num, start[0]*size + start[1], dtype=np.int64)
+    boundary = np.zeros(num, dtype=np.int64)
+    bad = np.zeros(num, dtype=np.int64)
+    illegal = np.zeros(num, dtype=np.int64)
+    reached, _, taken, _ = step_packed(game, tables, actions, starts, lengths, pos, boundary, bad, illegal)
+
+    trials = []
+    for i, (first, length, boundary_states, bad_states, illegal_moves, goal_reached) in enumerate(zip(starts.tolist(), lengths.tolist(), boundary.tolist(), bad.tolist(), illegal.tolist(), reached.tolist())):
+        trial = new_trial()
+        trial["boundary_states"] = boundary_states
+        trial["bad_states"] = bad_states
+        trial["illegal_moves"] = illegal_moves
+        trial["reaches_goal"] = goal_reached
+        trial["actual_path"] = bytearray(actions[first:first + length][taken[first:first + length]].tobytes())
+        trial["fitness"] = len(trial["actual_path"]) # Reward exploration and making good moves
+        trials.append(score_trial(trial, size))
+    return trials
+
+# Moves per node of the PrefixCache trie. Traces shorter than PREFIX_MIN are only stepped: walking and growing the trie
+# costs more per trace than the lockstep evaluator takes for their moves
+PREFIX_CHUNK = 32
+PREFIX_MIN = 4 * PREFIX_CHUNK
+
+# State of the simulation after the prefix ending with the chunk of moves key. path holds the moves of the chunk
+# that were made, reaches_goal is set when the goal was reached in the chunk (the moves after it are ignored).
+class _TrieNode:
+    __slots__ = ('parent', 'key', 'children', 'cell', 'boundary_states', 'bad_states', 'illegal_moves', 'path', 'reaches_goal')
+
+    def __init__(self, parent, key, cell):
+        self.parent = parent
+        self.key = key
+        self.children = {}
+        self.cell = cell
+        self.boundary_states = 0
+        self.bad_states = 0
+        self.illegal_moves = 0
+        self.path = b''
+        self.reaches_goal = False
+
+# Trie of simulated trace prefixes on one game, one node per PREFIX_CHUNK moves. Evaluating a population walks every
+# trace down to its longest cached prefix, then steps the remaining moves of all the traces at once from the cached
+# states with step_packed and adds the chunks they completed. At most max_nodes nodes are kept, the least recently
+# used are evicted. hits counts moves served from the cache, misses counts moves that had to be simulated.
+class PrefixCache:
+    def __init__(self, game, max_nodes=100000):
+        self.game = game
+        self.max_nodes = max_nodes
+        self.tables = board_tables(game)
+        start = game.board.components['Player'].pos
+        self.root = _TrieNode(None, None, start[0]*game.board.size + start[1])
+        self.lru = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.lru)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"nodes": len(self.lru), "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "hit_rate": self.hits / total if total else 0.0}
+
+    # Same trial as simulate(game, trace)
+    def evaluate(self, trace):
+        return self.evaluate_population([trace])[0]
+
+    # Same trials as evaluate_population(game, population)
+    def evaluate_population(self, population):
+        lru = self.lru
+        traces = [bytes(encode_trace(trace)) for trace in population]
+        walked = []
+        suffixes = []
+        for trace in traces:
+            node = self.root
+            nodes = []
+            depth = 0
+            while len(trace) >= PREFIX_MIN and not node.reaches_goal and depth + PREFIX_CHUNK <= len(trace):
+                child = node.children.get(trace[depth:depth + PREFIX_CHUNK])
+                if child is None:
+                    break
+                lru.move_to_end(child)
+                nodes.append(child)
+                node = child
+                depth += PREFIX_CHUNK
+            self.hits += depth
+            walked.append(nodes)
+            suffixes.append(b'' if node.reaches_goal else trace[depth:])
+
+        ends = [nodes[-1] if nodes else self.root for nodes in walked]
+        pos = np.array([node.cell for node in ends], dtype=np.int64)
+        boundary = np.array([node.boundary_states for node in ends], dtype=np.int64)
+        bad = np.array([node.bad_states for node in ends], dtype=np.int64)
+        illegal = np.array([node.illegal_moves for node in ends], dtype=np.int64)
+        actions, starts, lengths = pack_population(suffixes)
+        reached, ran, taken, steps = step_packed(self.game, self.tables, actions, starts, lengths, pos, boundary, bad, illegal, record=True)
+        self.misses += int(ran.sum())
+        self._insert(traces, walked, ends, actions, starts, lengths, ran, reached, taken, steps)
+        self._evict()
+
+        trials = []
+        for nodes, end, first, length, boundary_states, bad_states, illegal_moves, goal_reached in zip(walked, ends, starts.tolist(), lengths.tolist(), boundary.tolist(), bad.tolist(), illegal.tolist(), reached.tolist()):
+            trial = new_trial()
+            trial["boundary_states"] = boundary_states
+            trial["bad_states"] = bad_states
+            trial["illegal_moves"] = illegal_moves
+            trial["reaches_goal"] = end.reaches_goal or goal_reached
+            path = actions[first:first + length][taken[first:first + length]].tobytes()
+            trial["actual_path"] = bytearray(b''.join([node.path for node in nodes] + [path]) if nodes else path)
+            trial["fitness"] = len(trial["actual_path"]) # Reward exploration and making good moves
+            trials.append(score_trial(trial, self.game.board.size))
+        return trials
+
+    # Add a node for every whole chunk of moves stepped from the end of a cached prefix, with the state after its last
+    # move made (the goal ends a chunk early), read off the per move flags step_packed recorded
+    def _insert(self, traces, walked, ends, actions, starts, lengths, ran, reached, taken, steps):
+        lru = self.lru
+        cells, near, in_pit = steps
+        zero = np.zeros(1, dtype=np.int64)
+        boundary_totals = np.concatenate([zero, np.cumsum(near & taken)])
+        bad_totals = np.concatenate([zero, np.cumsum(in_pit)])
+        illegal_totals = np.concatenate([zero, np.cumsum(~taken)])
+        for i in np.flatnonzero(ran).tolist():
+            if len(traces[i]) < PREFIX_MIN:
+                continue
+            node = ends[i]
+            first, length, made = int(starts[i]), int(lengths[i]), int(ran[i])
+            depth = PREFIX_CHUNK * len(walked[i])
+            for offset in range(0, made, PREFIX_CHUNK):
+                if offset + PREFIX_CHUNK > length:
+                    break
+                key = traces[i][depth + offset:depth + offset + PREFIX_CHUNK]
+                child = node.children.get(key)
+                if child is None:
+                    end = min(offset + PREFIX_CHUNK, made)
+                    child = _TrieNode(node, key, int(cells[first + end - 1]))
+                    child.boundary_states = ends[i].boundary_states + int(boundary_totals[first + end] - boundary_totals[first])
+                    child.bad_states = ends[i].bad_states + int(bad_totals[first + end] - bad_totals[first])
+                    child.illegal_moves = ends[i].illegal_moves + int(illegal_totals[first + end] - illegal_totals[first])
+                    child.path = actions[first + offset:first + end][taken[first + offset:first + end]].tobytes()
+                    child.reaches_goal = bool(reached[i]) and end == made
+                    node.children[key] = child
+                    lru[child] = None
+                else:
+                    lru.move_to_end(child)
+                node = child
+
+    # Drop least recently used nodes. Descendants are always used after their ancestors so these are normally leaves,
+    # an evicted inner node only orphans its subtree which then ages out of the lru as well.
+    def _evict(self):
+        while len(self.lru) > self.max_nodes:
+            node, _ = self.lru.popitem(last=False)
+            siblings = node.parent.children
+            if siblings.get(node.key) is node:
+                del siblings[node.key]
+            self.evictions += 1
+
+# Worker side state of the evaluation pool, the game and its tables are sent once per worker by the initializer
+_worker_game = None
+_worker_tables = None
+
+def _init_worker(game, tables):
+    global _worker_game, _worker_tables
+    _worker_game = game
+    _worker_tables = tables
+
+def _evaluate_chunk(chunk):
+    return evaluate_population(_worker_game, chunk, _worker_tables)
+
+def make_pool(game, workers, tables=None):
+    return Pool(workers, initializer=_init_worker, initargs=(game, tables if tables is not None else board_tables(game)))
+
+# Split the population in chunks of chunk_size traces and evaluate them on the pool, trials come back in population order
+def evaluate_parallel(pool, population, chunk_size):
+    chunks = [population[i:i+chunk_size] for i in range(0, len(population), chunk_size)]
+    trials = []
+    for chunk_trials in pool.map(_evaluate_chunk, chunks, chunksize=1):
+        trials.extend(chunk_trials)
+    return trials
+
+# Neighbour exploration order of get_first_trace for each preference
+PREFERENCE_ORDERS = {'u': 'udlr', 'd': 'dlru', 'l': 'lrud', 'r': 'rudl'}
+
+# Multi-source BFS from all goals, field[pos] is the number of moves from pos to the closest goal (-1 if no goal is reachable).
+# Computed once per board and shared by the seeding functions below.
+# On sparse boards the field is a SparseCells holding only the reachable cells.
+def distance_field(game):
+    size = game.board.size
+    if game.board.sparse:
+        cells = game.board.cells
+        field = SparseCells(size, default=-1)
+        queue = deque(game.board.cells.ids(GOAL).tolist())
+    else:
+        cells = game.board.cells.tobytes()
+        field = [-1] * (size*size)
+        queue = deque(i for i, flags in enumerate(cells) if flags & GOAL)
+    for i in queue:
+        field[i] = 0
+    while queue:
+        i = queue.popleft()
+        row, col = divmod(i, size)
+        dist = field[i] + 1
+        for j, ok in ((i-size, row > 0), (i+size, row < size-1), (i-1, col > 0), (i+1, col < size-1)):
+            if ok and field[j] < 0 and not cells[j] & WALL:
+                field[j] = dist
+                queue.append(j)
+    return field if game.board.sparse else np.array(field, dtype=np.int32).reshape(size, size)
+
+# DFS Traversal to get a winning path. Visited cells are kept in a bitmap (a SparseCells on sparse boards) so the search is
+# linear in the board area. If the distance field of the board is passed, boards where no goal is reachable return None
+# without searching.
+def get_first_trace(game, preference_order='u', field=None): # preference order is what node to explore first.
+    size = game.board.size
+    sparse = game.board.sparse
+    cells = game.board.cells if sparse else game.board.cells.tobytes()
     start = game.board.components["Player"].pos
+    if field is not None and field[start] < 0:
+        return None
+    order = [(move, MOVES[move]) for move in PREFERENCE_ORDERS.get(preference_order, '')]
+    visited = SparseCells(size) if sparse else bytearray(size*size)
     stack = [(start, 'start', None)]
-    visited = [(start, 'start', None)]
-    path = []
-    boundary_states = set()
     while stack:
         curr = stack.pop()
-        path.append(curr)
-        neighbors = []
-        up = (curr[0][0]-1, curr[0][1]) 
-        down = (curr[0][0]+1, curr[0][1]) 
-        left = (curr[0][0], curr[0][1]-1) 
-        right = (curr[0][0], curr[0][1]+1) 
-        if game.is_pit(up):
-            boundary_states.add(curr[0])
-        if game.is_pit(down):
-            boundary_states.add(curr[0])
-        if game.is_pit(right):
-            boundary_states.add(curr[0])
-        if game.is_pit(left):
-            boundary_states.add(curr[0])
-
-        if preference_order == 'u':
-            neighbors.append((up, 'u', curr)) #up
-            neighbors.append((down, 'd', curr)) #down
-            neighbors.append((left, 'l', curr)) #left
-            neighbors.append((right, 'r', curr)) #right
-        elif preference_order == 'd':
-            neighbors.append((down, 'd', curr)) #down
-            neighbors.append((left, 'l', curr)) #left
-            neighbors.append((right, 'r', curr)) #right
-            neighbors.append((up, 'u', curr)) #up
-        elif preference_order == 'l':
-            neighbors.append((left, 'l', curr)) #left
-            neighbors.append((right, 'r', curr)) #right
-            neighbors.append((up, 'u', curr)) #up
-            neighbors.append((down, 'd', curr)) #down
-        elif preference_order == 'r':
-            neighbors.append((right, 'r', curr)) #right
-            neighbors.append((up, 'u', curr)) #up
-            neighbors.append((down, 'd', curr)) #down
-            neighbors.append((left, 'l', curr)) #left
-        for (neighbor, action, parent) in neighbors:
-            if game.valid_move(neighbor) and neighbor not in visited:
-                visited.append(neighbor)
-                stack.append((neighbor, action, parent))
-                if game.is_goal(neighbor):
-                    path.append((neighbor,action, parent))
-
-                    return backtrack_path(path)
+        row, col = curr[0]
+        for action, (row_offset, col_offset) in order:
+            neighbor_row = row + row_offset
+            neighbor_col = col + col_offset
+            if 0 <= neighbor_row < size and 0 <= neighbor_col < size:
+                i = neighbor_row*size + neighbor_col
+                if visited[i] or cells[i] & WALL:
+                    continue
+                visited[i] = 1
+                node = ((neighbor_row, neighbor_col), action, curr)
+                stack.append(node)
+                if cells[i] & GOAL:
+                    return backtrack_path([node])
+
+# Shortest path to a goal following the distance field, ties are broken by the preference order. Same format as get_first_trace.
+def get_shortest_trace(game, field, preference_order='u'):
+    size = game.board.size
+    start = game.board.components["Player"].pos
+    if field[start] < 0:
+        return None
+    order = [(move, MOVES[move]) for move in PREFERENCE_ORDERS.get(preference_order, 'udlr')]
+    curr = (start, 'start', None)
+    path = [curr]
+    while field[curr[0]] > 0:
+        row, col = curr[0]
+        for action, (row_offset, col_offset) in order:
+            neighbor = (row + row_offset, col + col_offset)
+            if 0 <= neighbor[0] < size and 0 <= neighbor[1] < size and field[neighbor] == field[curr[0]] - 1:
+                curr = (neighbor, action, curr)
+                path.append(curr)
+                break
+    return backtrack_path(path)
 
 def backtrack_path(path):
     proper_path =[]
@@ -108,7 +588,23 @@ def get_actions(path):
     
     return actions
    
-def initialize_population(num_population, game):
+# Independent numpy Generators for parallel workers, islands or jobs. seed is an int, a SeedSequence or a Generator
+# (spawned from), child i is the same stream however many workers the children are spread over.
+def spawn_rngs(seed, count):
+    if isinstance(seed, np.random.Generator):
+        return seed.spawn(count)
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    return [np.random.default_rng(child) for child in seed.spawn(count)]
+
+# count random traces of length moves each, drawn in one call from the Generator rng
+def random_traces(count, length, rng):
+    genes = rng.integers(0, NOOP, count * length, dtype=np.uint8).tobytes()
+    return [bytearray(genes[start:start + length]) for start in range(0, count * length, length)]
+
+# seeding='dfs' seeds with the directional DFS traces, seeding='shortest' with shortest paths read off the distance field.
+# With a numpy Generator rng the random traces come from it in one draw, else from the random module one move at a time.
+def initialize_population(num_population, game, seeding='dfs', rng=None):
 
     # create the genetic material for the population size and have it be random for each of them other then the first 4, which
     # are DFS traversals with directional preferences
@@ -116,23 +612,33 @@ def initialize_population(num_population, game):
     if num_population < 4:
         print("POP SIZE MUST BE GREATER THAN 4")
         exit()
+
+    # The DFS seeds of a sparse board do without the field, building it would visit every reachable cell
+    field = distance_field(game) if seeding == 'shortest' or not game.board.sparse else None
+    if field is not None and field[game.board.components["Player"].pos] < 0:
+        raise ValueError("No goal is reachable from the player position")
+    seed_trace = get_shortest_trace if seeding == 'shortest' else lambda game, field, preference_order: get_first_trace(game, preference_order, field)
     
-    trace0 = get_actions(get_first_trace(game, preference_order='r'))
-    trace1 = get_actions(get_first_trace(game, preference_order='u'))
-    trace2 = get_actions(get_first_trace(game, preference_order='l'))
-    trace3 = get_actions(get_first_trace(game, preference_order='d'))
+    seeds = [seed_trace(game, field, preference_order=preference_order) for preference_order in 'ruld']
+    if None in seeds:
+        raise ValueError("No goal is reachable from the player position")
+    trace0, trace1, trace2, trace3 = (encode_trace(get_actions(seed)) for seed in seeds)
     population = [trace0, trace1, trace2, trace3]
     
 
     extra_randoms = num_population - 4
+    if rng is not None:
+        population.extend(random_traces(extra_randoms, game.board.size, rng))
+        return population
+
     # create a gene for the population number
     for x in range(extra_randoms):
 
         # Set initial values to choose from
-        moves = ['u', 'd', 'l', 'r']
+        moves = list(range(NOOP))
         
 
-        rand_trace = []
+        rand_trace = bytearray()
         # For a random amount of moves make random moves.
         for i in range(game.board.size, game.board.size * 2):
             rand_trace.append(random.choice(moves))
@@ -142,69 +648,571 @@ def initialize_population(num_population, game):
 
     return population
 
-def genetic_algorithm(population, game, max_generation, probability_crossover, probability_mutation, generational_stats, gen_count):
-    while max_generation > 0:
-        fitness = []
-        trials = []
-        pop_no_extra_moves = []
-        for trace in population:
-            new_game = deepcopy(game)
-            trial = get_fitness(new_game, trace)
-            fitness.append(trial["fitness"])
-            trials.append(trial)
-            pop_no_extra_moves.append(trial["actual_path"])
-            #new_game.dispGrid()
-            #print(f"Fitness: {trial['fitness']}")
-            #print(f"Moves Taken: {trial['actual_path']}")
-            #trial_num += 1
+# Evaluates whole populations for genetic_algorithm: through the PrefixCache if one is given, on a process pool
+# in chunks of chunk_size traces (default: one chunk per worker) if workers > 1, else with the batched evaluator.
+# Workers never touch the random state so the result is the same as the serial run.
+class PopulationEvaluator:
+    def __init__(self, game, workers=0, chunk_size=0, cache=None):
+        self.game = game
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.cache = cache
+        self.tables = board_tables(game)
+        if workers > 1 and cache is not None:
+            raise ValueError("the prefix cache evaluates in this process, it cannot be used with workers")
+        self.pool = make_pool(game, workers, self.tables) if workers > 1 else None
+
+    def __call__(self, population):
+        if self.cache is not None:
+            return self.cache.evaluate_population(population)
+        if self.pool is None:
+            return evaluate_population(self.game, population, self.tables)
+        return evaluate_parallel(self.pool, population, self.chunk_size or -(-len(population) // self.workers))
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# AFL-style coverage of a whole run: a bitmap of the (cell, action) transitions taken and one of the boundary cells
+# (next to a pit) reached by any trace evaluated so far. update() walks the actual paths of a batch of trials,
+# credits every transition and boundary cell seen for the first time to the first trace of the batch reaching it,
+# stores that count as trial["new_coverage"] and adds weight times it to the trial's fitness.
+# Traces with new coverage are kept in corpus and passed to on_new(gen_count, trials) (e.g. a corpus writer).
+class Coverage:
+    def __init__(self, game, weight=1.0, on_new=None):
+        size = game.board.size
+        self.weight = weight
+        self.on_new = on_new
+        _, _, _, _, self.boundary_cells = board_tables(game)
+        # Cell id offset of each move code
+        self.offsets = np.array([row*size + col for row, col in MOVE_OFFSETS] + [0], dtype=np.int64)
+        row, col = game.board.components['Player'].pos
+        self.start = row*size + col
+        # Bitmaps of cell*NOOP + action and of cells, sorted ids of the covered ones on sparse boards
+        self.sparse = game.board.sparse
+        if self.sparse:
+            self.transitions = _SortedIds(np.zeros(0, dtype=np.int64))
+            self.boundary = _SortedIds(np.zeros(0, dtype=np.int64))
+        else:
+            self.transitions = np.zeros(size*size*NOOP, dtype=bool)
+            self.boundary = np.zeros(size*size, dtype=bool)
+        self.corpus = []
+        self.evaluated = 0
+
+    def stats(self):
+        if self.sparse:
+            transitions, boundary = len(self.transitions.ids), len(self.boundary.ids)
+        else:
+            transitions, boundary = int(self.transitions.sum()), int(self.boundary.sum())
+        return {"transitions": transitions, "boundary_states": boundary, "corpus": len(self.corpus), "evaluated": self.evaluated}
+
+    # For GA checkpoints, the bitmaps or on sparse boards the covered ids
+    def state(self):
+        if self.sparse:
+            return {"sparse": True, "transitions": self.transitions.ids, "boundary": self.boundary.ids, "corpus": self.corpus, "evaluated": self.evaluated}
+        return {"sparse": False, "transitions": self.transitions, "boundary": self.boundary, "corpus": self.corpus, "evaluated": self.evaluated}
+
+    def restore(self, state):
+        if self.sparse:
+            self.transitions.ids = np.array(state["transitions"], dtype=np.int64)
+            self.boundary.ids = np.array(state["boundary"], dtype=np.int64)
+        else:
+            self.transitions[:] = state["transitions"][:len(self.transitions)]
+            self.boundary[:] = state["boundary"][:len(self.boundary)]
+        self.corpus = list(state["corpus"])
+        self.evaluated = state["evaluated"]
+
+    def update(self, trials, gen_count=0):
+        # Actual paths only hold moves that were made, so the cell after every move is the start plus the running sum
+        # of the moves' cell offsets, computed for all the paths at once over their concatenation
+        actions, starts, lengths = pack_population([trial["actual_path"] for trial in trials])
+        num_traces = len(trials)
+        offsets = self.offsets[actions]
+        totals = np.concatenate([[0], np.cumsum(offsets)])
+        cells = self.start + totals[1:] - np.repeat(totals[starts], lengths)
+        edges = (cells - offsets)*NOOP + actions
+
+        owners = np.repeat(np.arange(num_traces), lengths)
+        new_transitions = self._credit(self.transitions, edges, owners, num_traces)
+        on_boundary = self.boundary_cells[cells]
+        new_boundary = self._credit(self.boundary, cells[on_boundary], owners[on_boundary], num_traces)
+
+        new = []
+        for trial, new_coverage in zip(trials, (new_transitions + new_boundary).tolist()):
+            trial["new_coverage"] = new_coverage
+            if new_coverage:
+                trial["fitness"] += self.weight * new_coverage
+                new.append(trial)
+        self.evaluated += num_traces
+        self.corpus.extend(bytearray(trial["actual_path"]) for trial in new)
+        if self.on_new is not None and new:
+            self.on_new(gen_count, new)
+        return trials
+
+    # Set the ids not in bitmap (or _SortedIds) yet and count them per owner, owners are ascending so the first hit of an id is the earliest trace
+    @staticmethod
+    def _credit(bitmap, ids, owners, num_traces):
+        fresh = ~bitmap[ids]
+        ids, first = np.unique(ids[fresh], return_index=True)
+        bitmap[ids] = True
+        return np.bincount(owners[fresh][first], minlength=num_traces)
+
+# Wall time of the phases of a generation: with timer.phase('selection'): ... adds the time spent in the block to that phase
+class PhaseTimer:
+    def __init__(self):
+        self.times = {}
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.times[name] = self.times.get(name, 0.0) + time.perf_counter() - start
+
+# Metrics of one generation as passed to the on_metrics callback of genetic_algorithm. The population figures are taken
+# from the evaluated population, the timings once the next generation is made.
+def generation_metrics(gen_count, population, fitness):
+    return {"generation": gen_count, "population": len(population),
+            "population_bytes": sum(sys.getsizeof(gene) for gene in population),
+            "unique_genes": len(set(map(bytes, population))),
+            "max_fitness": max(fitness), "avg_fitness": sum(fitness) / len(fitness)}
+
+def add_timings(metrics, evaluations, timer, seconds):
+    evaluation_time = timer.times.get('evaluation', 0.0)
+    metrics.update({"evaluations": evaluations, "evals_per_second": evaluations / evaluation_time if evaluation_time > 0 else None,
+                    "seconds": seconds, "phases": dict(timer.times)})
+    return metrics
+
+# Early stopping of genetic_algorithm, checked after every generation is evaluated: stop once the max fitness reaches
+# target_fitness, once it has not improved for plateau generations or once deadline seconds have passed since the run
+# started. reason says why the run stopped ('target', 'plateau', 'deadline' or 'max_generation' if it ran to the end).
+class StopCondition:
+    def __init__(self, deadline=None, plateau=0, target_fitness=None):
+        self.deadline = deadline
+        self.plateau = plateau
+        self.target_fitness = target_fitness
+        self.reason = None
+        self.start = None
+        self.best_fitness = None
+        self.stale = 0
+        self.generations = 0
+
+    # Record the max fitness of a generation, returns the stop reason or None to go on
+    def update(self, max_fitness):
+        if self.start is None:
+            self.start = time.monotonic()
+        self.generations += 1
+        if self.best_fitness is None or max_fitness > self.best_fitness:
+            self.best_fitness = max_fitness
+            self.stale = 0
+        else:
+            self.stale += 1
+        if self.target_fitness is not None and max_fitness >= self.target_fitness:
+            self.reason = 'target'
+        elif self.plateau and self.stale >= self.plateau:
+            self.reason = 'plateau'
+        elif self.deadline is not None and time.monotonic() - self.start >= self.deadline:
+            self.reason = 'deadline'
+        return self.reason
+
+    def stats(self):
+        return {"reason": self.reason, "generations": self.generations, "best_fitness": self.best_fitness,
+                "seconds": time.monotonic() - self.start if self.start is not None else 0.0}
+
+    # Progress for a checkpoint, restore() carries on from it (the deadline counts the time spent before it)
+    def state(self):
+        return {"best_fitness": self.best_fitness, "stale": self.stale, "generations": self.generations,
+                "seconds": time.monotonic() - self.start if self.start is not None else 0.0}
+
+    def restore(self, state):
+        self.best_fitness = state["best_fitness"]
+        self.stale = state["stale"]
+        self.generations = state["generations"]
+        self.start = time.monotonic() - state["seconds"]
+
+# Checkpoints of a genetic_algorithm run, written every interval generations to path (see save_ga_state).
+# config is stored with them as it is, e.g. the settings needed to rebuild the game when resuming.
+# outputs maps names to the writers the run streams to (corpus writers, MetricsLog), their position() is stored as well
+# so a resumed run can reopen them where the checkpoint was taken instead of starting them over.
+class GACheckpoint:
+    def __init__(self, path, interval=1, config=None, outputs=None):
+        self.path = path
+        self.interval = interval
+        self.config = config
+        self.outputs = outputs or {}
+
+    def due(self, gen_count):
+        return self.interval > 0 and gen_count % self.interval == 0
+
+    def save(self, state):
+        state["config"] = self.config
+        state["outputs"] = {name: writer.position() for name, writer in self.outputs.items()}
+        save_ga_state(self.path, state)
+
+# Genes back to back, 2-bit packed unless one holds an illegal move code
+def _pack_genes(population):
+    genes = np.frombuffer(b''.join(population), dtype=np.uint8)
+    packed = not len(genes) or int(genes.max()) < NOOP
+    if packed:
+        genes = np.frombuffer(b''.join(pack_trace(gene) for gene in population), dtype=np.uint8)
+    return np.array([len(gene) for gene in population], dtype=np.uint32), genes, packed
+
+def _unpack_genes(lengths, genes, packed):
+    genes = genes.tobytes()
+    population = []
+    offset = 0
+    for length in lengths.tolist():
+        size = (length + 3) // 4 if packed else length
+        population.append(unpack_trace(genes[offset:offset + size], length) if packed else bytearray(genes[offset:offset + size]))
+        offset += size
+    return population
+
+# The GA state between two generations is written as an uncompressed .npz: the genes of the population 2-bit packed
+# back to back with their lengths, the key arrays of the random and np.random generators and a JSON blob with the rest
+# (generation counts, stats, best trial, trials of the mu+lambda survivors without their paths, stop progress, config,
+# output positions), plus the bit-packed bitmaps (covered ids on sparse boards) and the corpus of the Coverage if the run has one.
+# The file is written next to path, synced and renamed over it, so a kill leaves either the old or the new checkpoint.
+def save_ga_state(path, state):
+    population = state["population"]
+    lengths, genes, packed = _pack_genes(population)
+    best_trial = state["best_trial"]
+    random_version, random_key, random_gauss = state["random"]
+    np_random = state["np_random"]
+    meta = {"version": 1, "gen_count": state["gen_count"], "max_generation": state["max_generation"],
+            "generational_stats": state["generational_stats"], "best_fitness": state["best_fitness"],
+            "best_trial": dict(best_trial, actual_path=None) if best_trial else None,
+            "carried": [dict(trial, actual_path=None) for trial in state["carried"]] if state["carried"] is not None else None,
+            "stop": state["stop"], "packed": packed, "random_version": random_version, "random_gauss": random_gauss,
+            "np_random": [np_random[0], int(np_random[2]), int(np_random[3]), float(np_random[4])], "config": state.get("config"),
+            "outputs": state.get("outputs") or {}}
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        coverage = {}
+        if state.get("coverage") is not None:
+            corpus_lengths, corpus_genes, meta["coverage_packed"] = _pack_genes(state["coverage"]["corpus"])
+            meta["coverage_evaluated"] = state["coverage"]["evaluated"]
+            meta["coverage_sparse"] = sparse = state["coverage"]["sparse"]
+            pack = np.asarray if sparse else np.packbits
+            coverage = {"coverage_transitions": pack(state["coverage"]["transitions"]),
+                        "coverage_boundary": pack(state["coverage"]["boundary"]),
+                        "coverage_lengths": corpus_lengths, "coverage_genes": corpus_genes}
+        np.savez(f, meta=np.frombuffer(json.dumps(meta).encode(), dtype=np.uint8), **coverage,
+                 lengths=lengths, genes=genes,
+                 best_gene=np.frombuffer(bytes(state["best_gene"] or b''), dtype=np.uint8),
+                 random_key=np.array(random_key, dtype=np.uint32), np_random_key=np.asarray(np_random[1], dtype=np.uint32))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+def load_ga_state(path):
+    with np.load(path) as data:
+        meta = json.loads(data["meta"].tobytes())
+        population = _unpack_genes(data["lengths"], data["genes"], meta["packed"])
+        best_gene = bytearray(data["best_gene"].tobytes())
+        random_key = tuple(data["random_key"].tolist())
+        np_random_key = data["np_random_key"]
+        coverage = None
+        if "coverage_transitions" in data:
+            # unpackbits pads the bitmaps to whole bytes, Coverage.restore cuts them back
+            sparse = meta.get("coverage_sparse", False)
+            unpack = np.asarray if sparse else (lambda covered: np.unpackbits(covered).astype(bool))
+            coverage = {"sparse": sparse, "transitions": unpack(data["coverage_transitions"]),
+                        "boundary": unpack(data["coverage_boundary"]),
+                        "corpus": _unpack_genes(data["coverage_lengths"], data["coverage_genes"], meta["coverage_packed"]),
+                        "evaluated": meta["coverage_evaluated"]}
+    carried = None
+    if meta["carried"] is not None:
+        carried = [dict(trial, actual_path=gene) for trial, gene in zip(meta["carried"], population)]
+    best_trial = dict(meta["best_trial"], actual_path=best_gene) if meta["best_trial"] is not None else None
+    name, pos, has_gauss, cached_gaussian = meta["np_random"]
+    return {"population": population, "carried": carried, "gen_count": meta["gen_count"], "max_generation": meta["max_generation"],
+            "generational_stats": [tuple(stats) for stats in meta["generational_stats"]],
+            "best_fitness": meta["best_fitness"], "best_gene": best_gene if best_trial is not None else None, "best_trial": best_trial,
+            "stop": meta["stop"], "random": (meta["random_version"], random_key, meta["random_gauss"]),
+            "np_random": (name, np_random_key, pos, has_gauss, cached_gaussian), "coverage": coverage, "config": meta["config"],
+            "outputs": meta.get("outputs", {})}
+
+# Generator form of the GA: yields each generation's dict once it is evaluated (snapshot_generation to keep one), returns what genetic_algorithm returns
+def evolve(population, game, max_generation, probability_crossover, probability_mutation, generational_stats, gen_count,
+           workers=0, chunk_size=0, cache=None, # how fitness is evaluated, see PopulationEvaluator
+           on_generation=None, # on_generation(gen_count, trials) after every evaluation, e.g. to stream a corpus
+           selection='roulette', # parent selection method of select_indices
+           replacement='steady', # 'steady', 'generational' (elites plus a batch of children) or 'mu+lambda' (best of parents and children)
+           offspring=0, # mu+lambda children per generation, 0 for the population size
+           on_metrics=None, # on_metrics(metrics) with the generation_metrics and phase timings of every generation
+           stop=None, # StopCondition to end before max_generation, stop.reason says why
+           checkpoint=None, # GACheckpoint the state is saved to between generations
+           resume=None, # load_ga_state state to go on from, with its population, max_generation, generational_stats and gen_count passed too
+           coverage=None): # Coverage that adds a bonus to trials reaching new transitions/boundary cells
+    if replacement not in REPLACEMENTS:
+        raise ValueError(f"Unknown replacement strategy {replacement!r}")
+    if stop is not None and stop.start is None:
+        stop.start = time.monotonic()
+    with PopulationEvaluator(game, workers, chunk_size, cache) as evaluate:
+        carried = None # trials of the survivors kept by mu+lambda
+        best_fitness = best_gene = best_trial = None
+        if resume is not None:
+            carried = resume["carried"]
+            best_fitness, best_gene, best_trial = resume["best_fitness"], resume["best_gene"], resume["best_trial"]
+            if stop is not None and resume["stop"] is not None:
+                stop.restore(resume["stop"])
+            if coverage is not None and resume["coverage"] is not None:
+                coverage.restore(resume["coverage"])
+            random.setstate(resume["random"])
+            np.random.set_state(resume["np_random"])
+        while max_generation > 0:
+            generation_start = time.perf_counter()
+            timer = PhaseTimer()
+            fitness = []
+            trials = []
+            pop_no_extra_moves = []
+            with timer.phase('evaluation'):
+                if carried is None:
+                    evaluated = evaluate(population)
+                    evaluations = len(population)
+                    if coverage is not None:
+                        coverage.update(evaluated, gen_count)
+                else:
+                    evaluated = carried
+                    carried = None
+                    evaluations = 0
+            for trial in evaluated:
+                fitness.append(trial["fitness"])
+                trials.append(trial)
+                pop_no_extra_moves.append(trial["actual_path"])
+                #print(f"Fitness: {trial['fitness']}")
+                #print(f"Moves Taken: {trial['actual_path']}")
+                #trial_num += 1
         
-        population = pop_no_extra_moves
-
-        # Book Keeping
-        final_fitness = fitness.copy()
-        final_population = population.copy()
-        max_fitness = max(fitness)
-        min_fitness = min(fitness)
-        avg_fitness = sum(fitness)/len(fitness)
-        max_fitness_gene = population[fitness.index(max_fitness)]
-        max_fitness_trial = trials[fitness.index(max_fitness)]
-        this_generation_stats = (max_fitness, min_fitness, avg_fitness, gen_count)
-        generational_stats.append(this_generation_stats)
-        max_generation = max_generation - 1
-        gen_count = gen_count + 1
+            population = pop_no_extra_moves
+            if on_generation is not None:
+                on_generation(gen_count, trials)
+
+            # Book Keeping
+            final_fitness = fitness.copy()
+            final_population = population.copy()
+            max_fitness = max(fitness)
+            min_fitness = min(fitness)
+            avg_fitness = sum(fitness)/len(fitness)
+            max_fitness_gene = population[fitness.index(max_fitness)]
+            max_fitness_trial = trials[fitness.index(max_fitness)]
+            # Best of the whole run, copied since the steady scheme mutates the genes in place
+            if best_fitness is None or max_fitness > best_fitness:
+                best_fitness = max_fitness
+                best_gene = bytearray(max_fitness_gene)
+                best_trial = dict(max_fitness_trial, actual_path=best_gene)
+            this_generation_stats = (max_fitness, min_fitness, avg_fitness, gen_count)
+            generational_stats.append(this_generation_stats)
+            max_generation = max_generation - 1
+            gen_count = gen_count + 1
+            if on_metrics is not None:
+                metrics = generation_metrics(gen_count - 1, population, fitness)
+            stop_reason = stop.update(max_fitness) if stop is not None else None
+            yield {"generation": gen_count - 1, "population": population, "trials": trials, "fitness": fitness,
+                   "stats": this_generation_stats, "best_fitness": best_fitness, "best_gene": best_gene, "best_trial": best_trial,
+                   "stop_reason": stop_reason}
         
-        # Take our population of ants and get the top 2 for later
-        elite1, elite2 = select_max(population, fitness)
+            if stop_reason is not None:
+                # Done, the evaluated population is returned as it is
+                pass
+            elif replacement == 'generational':
+                with timer.phase('selection'):
+                    elite1, elite2 = select_max(population, fitness)
+                children = make_offspring(population, fitness, len(population) - 2, probability_crossover, probability_mutation, selection, timer=timer)
+                population = [population[elite1], population[elite2]] + children
+            elif replacement == 'mu+lambda':
+                children = make_offspring(population, fitness, offspring or len(population), probability_crossover, probability_mutation, selection, timer=timer)
+                with timer.phase('evaluation'):
+                    child_trials = evaluate(children)
+                    if coverage is not None:
+                        coverage.update(child_trials, gen_count - 1)
+                    candidates = trials + child_trials
+                    evaluations += len(children)
+                with timer.phase('culling'):
+                    survivors = np.argsort([-trial["fitness"] for trial in candidates], kind='stable')[:len(population)]
+                    carried = [candidates[i] for i in survivors]
+                    population = [trial["actual_path"] for trial in carried]
+            else:
+                with timer.phase('selection'):
+                    # Take our population of ants and get the top 2 for later
+                    elite1, elite2 = select_max(population, fitness)
 
-        # Select the two for crossover and mutation (Two Random Rank)
-        parent1, parent2 = select(population, fitness)
+                    # Select the two for crossover and mutation (Two Random Rank)
+                    parent1, parent2 = select(population, fitness, selection)
 
-        # Crossover the selected  with a 2 point crossover (split into thirds, alternate between parents.)
-        crossed1, crossed2 = crossover(parent1, parent2, probability_crossover)
+                with timer.phase('crossover'):
+                    # Crossover the selected  with a 2 point crossover (split into thirds, alternate between parents.)
+                    crossed1, crossed2 = crossover(parent1, parent2, probability_crossover)
 
-        # Grab the information for the elites
-        elite1_gene = population[elite1]
-        elite2_gene = population[elite2]
+                # Grab the information for the elites
+                elite1_gene = population[elite1]
+                elite2_gene = population[elite2]
 
-        # Mutate the entire population by potentially increasing (wrap around) digits 2 and 3 of every single state. (chance for random reset of 0
-        # as well)
-        population = mutate_population(population, probability_mutation)
+                with timer.phase('mutation'):
+                    # Mutate the entire population by potentially increasing (wrap around) digits 2 and 3 of every single state. (chance for random reset of 0
+                    # as well)
+                    population = mutate_population(population, probability_mutation)
        
-        # Remove the elites so that they will not be culled
-        population.remove(population[elite1])
-        population.remove(population[elite2])
-        fitness.remove(fitness[elite1])
-        fitness.remove(fitness[elite2])
+                with timer.phase('culling'):
+                    # Remove the elites so that they will not be culled
+                    for elite in sorted((elite1, elite2), reverse=True):
+                        del population[elite]
+                        del fitness[elite]
         
         
-        # Create new population by culling random 2 and replace with the crossed over ones, keep the elite ones in.
-        new_population = cull_random(population, fitness)
-        new_population.append(elite1_gene)
-        new_population.append(elite2_gene)
-        new_population.append(crossed1)
-        new_population.append(crossed2)
+                    # Create new population by culling random 2 and replace with the crossed over ones, keep the elite ones in.
+                    new_population = cull_random(population, fitness)
+                    new_population.append(elite1_gene)
+                    new_population.append(elite2_gene)
+                    new_population.append(crossed1)
+                    new_population.append(crossed2)
+
+            if on_metrics is not None:
+                if stop_reason is not None:
+                    metrics["stop_reason"] = stop_reason
+                if coverage is not None:
+                    metrics["coverage"] = coverage.stats()
+                on_metrics(add_timings(metrics, evaluations, timer, time.perf_counter() - generation_start))
+            if stop_reason is not None:
+                break
+            if checkpoint is not None and max_generation > 0 and checkpoint.due(gen_count):
+                checkpoint.save({"population": population, "carried": carried, "gen_count": gen_count, "max_generation": max_generation,
+                                 "generational_stats": generational_stats, "best_fitness": best_fitness, "best_gene": best_gene,
+                                 "best_trial": best_trial, "stop": stop.state() if stop is not None else None,
+                                 "coverage": coverage.state() if coverage is not None else None,
+                                 "random": random.getstate(), "np_random": np.random.get_state()})
+
+    if stop is not None and stop.reason is None:
+        stop.reason = 'max_generation'
+
+    return best_fitness, best_gene, best_trial, generational_stats, population, final_fitness, final_population
 
-    return max_fitness, max_fitness_gene, max_fitness_trial, generational_stats, population, final_fitness, final_population
+# Runs evolve (same arguments) to the end and returns the best fitness, gene and trial, the generational stats, the next
+# population and the fitness and population of the last evaluated generation
+def genetic_algorithm(*args, **kwargs):
+    generations = evolve(*args, **kwargs)
+    while True:
+        try:
+            next(generations)
+        except StopIteration as done:
+            return done.value
+
+# Copy of a generation from evolve that stays as it is when the GA goes on
+def snapshot_generation(generation):
+    population = [bytearray(gene) for gene in generation["population"]]
+    trials = [dict(trial, actual_path=gene) for trial, gene in zip(generation["trials"], population)]
+    return dict(generation, population=population, trials=trials, fitness=list(generation["fitness"]))
+
+# Async iterator over evolve (same arguments): the GA runs in a thread and up to buffer generations (snapshots) wait for
+# the consumer, the GA blocks while the buffer is full. Leaving the loop early stops the GA after its current generation.
+async def aevolve(*args, buffer=1, **kwargs):
+    loop = asyncio.get_running_loop()
+    generations = Queue(buffer)
+    closed = threading.Event()
+
+    def put(item):
+        while not closed.is_set():
+            try:
+                generations.put(item, timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for generation in evolve(*args, **kwargs):
+                if not put(('generation', snapshot_generation(generation))):
+                    return
+        except BaseException as e:
+            put(('error', e))
+        else:
+            put(('done', None))
+
+    def get():
+        while True:
+            try:
+                return generations.get(timeout=0.1)
+            except Empty:
+                if closed.is_set():
+                    return ('done', None)
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            kind, item = await loop.run_in_executor(None, get)
+            if kind == 'done':
+                break
+            if kind == 'error':
+                raise item
+            yield item
+    finally:
+        closed.set()
+        await loop.run_in_executor(None, producer.join)
+
+# Island model: every island is its own population evolved by genetic_algorithm in its own process with its own random stream.
+# Every migration_interval generations the best num_migrants genes of each island replace the worst ones of the next island (ring).
+# Returns the best fitness, gene and trial over all islands, the stats of every island and the final island populations.
+def island_genetic_algorithm(populations, game, max_generation, probability_crossover, probability_mutation, migration_interval, num_migrants=2, selection='roulette', replacement='steady', offspring=0):
+    num_islands = len(populations)
+    rng_states = [random.Random(random.getrandbits(64)).getstate() for _ in range(num_islands)]
+    island_stats = [[] for _ in range(num_islands)]
+    best = None
+    gen_count = 0
+
+    with make_pool(game, num_islands) as pool:
+        while max_generation > 0:
+            generations = min(migration_interval, max_generation)
+            jobs = [(populations[i], rng_states[i], generations, probability_crossover, probability_mutation, gen_count, selection, replacement, offspring) for i in range(num_islands)]
+            results = pool.map(_run_island, jobs, chunksize=1)
+            max_generation -= generations
+            gen_count += generations
+
+            fitnesses = []
+            for i, (population, fitness, rng_state, stats, island_best) in enumerate(results):
+                populations[i] = population
+                fitnesses.append(fitness)
+                rng_states[i] = rng_state
+                island_stats[i].extend(stats)
+                if best is None or island_best[0] > best[0]:
+                    best = island_best
+
+            if max_generation > 0:
+                migrate(populations, fitnesses, num_migrants)
+
+    return best[0], best[1], best[2], island_stats, populations
+
+def _run_island(job):
+    population, rng_state, generations, probability_crossover, probability_mutation, gen_count, selection, replacement, offspring = job
+    random.setstate(rng_state)
+    max_fitness, max_fitness_gene, max_fitness_trial, stats, population, _, _ = \
+        genetic_algorithm(population, _worker_game, generations, probability_crossover, probability_mutation, [], gen_count, selection=selection, replacement=replacement, offspring=offspring)
+    fitness = [trial["fitness"] for trial in evaluate_population(_worker_game, population, _worker_tables)]
+    return population, fitness, random.getstate(), stats, (max_fitness, max_fitness_gene, max_fitness_trial)
+
+# Ring migration, the best genes of island i replace the worst of island i+1 (using the fitness from before the exchange)
+def migrate(populations, fitnesses, num_migrants):
+    migrants = []
+    for population, fitness in zip(populations, fitnesses):
+        order = sorted(range(len(population)), key=lambda i: fitness[i], reverse=True)
+        migrants.append([bytearray(population[i]) for i in order[:num_migrants]])
+    for i in range(len(populations)):
+        source = migrants[i - 1]
+        fitness = fitnesses[i]
+        worst = sorted(range(len(populations[i])), key=lambda j: fitness[j])[:len(source)]
+        for j, gene in zip(worst, source):
+            populations[i][j] = gene
+    return populations
 
 # Perform single point crossover based on crossover probability, halfway through
 def crossover(parent1, parent2, probability_crossover):
@@ -230,6 +1238,21 @@ def crossover(parent1, parent2, probability_crossover):
     else:
         return parent1, parent2
 
+# Make count children for the next generation in one batch: count/2 parent pairs are selected, crossed over and the
+# children (copies, the parents are not touched) are mutated
+# (the selection, crossover and mutation phases are added to timer if one is given)
+def make_offspring(population, fitness, count, probability_crossover, probability_mutation, selection='roulette', tournament_size=3, timer=None):
+    timer = timer or PhaseTimer()
+    with timer.phase('selection'):
+        first, second = select_pairs(fitness, -(-count // 2), selection, tournament_size)
+    with timer.phase('crossover'):
+        children = []
+        for index1, index2 in zip(first.tolist(), second.tolist()):
+            children.extend(crossover(population[index1], population[index2], probability_crossover))
+        children = [bytearray(child) for child in children[:count]]
+    with timer.phase('mutation'):
+        return mutate_population(children, probability_mutation)
+
 # Mutate the entire population by potentially adding a move in the mix randomly
 def mutate_population(population, probability_mutation):
     for trace in population:
@@ -239,70 +1262,113 @@ def mutate_population(population, probability_mutation):
         if random_val < probability_mutation:
 
             #Get transitions out of state1 and state2 + new random checks
-            rand_move = random.choice(['u', 'd', 'l', 'r'])
+            rand_move = random.choice(range(NOOP))
             rand_index = random.randint(0, len(trace))
             trace.insert(rand_index, rand_move)
                
     return population
        
 
-# Select and return two via roulette, with probability of choice weighted on their fitness in the old generation
-def select(old_gen1, fitness1):
-    old_gen = old_gen1.copy()
-    fitness = fitness1.copy()
+# Index drawn with probability proportional to weights. Same draw as random.choices with these weights (a single random() call
+# on the global stream) but on a NumPy cumulative sum, so it costs O(P) and no genes are compared.
+def weighted_index(weights):
+    cum_weights = np.cumsum(weights, dtype=np.float64)
+    total = cum_weights[-1] + 0.0
+    if not total > 0.0:
+        raise ValueError('Total of weights must be greater than zero')
+    return min(int(np.searchsorted(cum_weights, random.random() * total, side='right')), len(cum_weights) - 1)
+
+# Two different indexes drawn with probability proportional to weights, the second without the first
+def weighted_pair(weights):
+    weights = np.asarray(weights, dtype=np.float64)
+    index1 = weighted_index(weights)
+    index2 = weighted_index(np.delete(weights, index1))
+    return index1, index2 + (index2 >= index1)
 
-    # Get the first gene
-    gene1 = random.choices(old_gen1, weights=fitness, k=1)
-    gene1 = gene1[0]
+# Best of tournament_size random individuals (other than exclude), ties go to the first drawn
+def tournament_index(fitness, tournament_size, exclude=-1):
+    pool_size = len(fitness) - (exclude >= 0)
+    best = -1
+    for _ in range(tournament_size):
+        index = random.randrange(pool_size)
+        if exclude >= 0 and index >= exclude:
+            index += 1
+        if best < 0 or fitness[index] > fitness[best]:
+            best = index
+    return best
 
-    # Get the index from first gene and  remove the fitness of it from fitness, and the gene from oldgen to get the second
-    gene1_index = old_gen.index(gene1)
-    old_gen.remove(gene1)
-    fitness.remove(fitness[gene1_index])
+# Weights of roulette (the fitness) and rank (1 for the worst up to the population size) selection
+def selection_weights(fitness, method):
+    fitness = np.asarray(fitness, dtype=np.float64)
+    if method == 'roulette':
+        return fitness
+    elif method == 'rank':
+        ranks = np.empty(len(fitness), dtype=np.float64)
+        ranks[np.argsort(fitness, kind='stable')] = np.arange(1, len(fitness) + 1)
+        return ranks
+    raise ValueError(f"Unknown selection method {method!r}")
 
-    # Get the second
-    #print(f"Fitness {fitness}")
-    gene2 = random.choices(old_gen, weights=fitness, k=1)
-    gene2 = gene2[0] 
+# num_pairs parent pairs at once (two index arrays), the two parents of a pair are always different.
+# All random draws are made up front from the global stream and mapped with one searchsorted, a second parent equal to
+# the first is redrawn, which gives the same distribution as drawing it without the first.
+def select_pairs(fitness, num_pairs, method='roulette', tournament_size=3):
+    if method == 'tournament':
+        pairs = [select_indices(fitness, method, tournament_size) for _ in range(num_pairs)]
+        pairs = np.array(pairs, dtype=np.int64).reshape(num_pairs, 2)
+        return pairs[:, 0], pairs[:, 1]
+    cum_weights = np.cumsum(selection_weights(fitness, method))
+    total = cum_weights[-1] + 0.0
+    if not total > 0.0:
+        raise ValueError('Total of weights must be greater than zero')
+    last = len(cum_weights) - 1
+    draws = np.array([random.random() for _ in range(2 * num_pairs)]) * total
+    pairs = np.minimum(np.searchsorted(cum_weights, draws, side='right'), last).reshape(num_pairs, 2)
+    for k in np.flatnonzero(pairs[:, 0] == pairs[:, 1]):
+        while pairs[k, 1] == pairs[k, 0]:
+            pairs[k, 1] = min(int(np.searchsorted(cum_weights, random.random() * total, side='right')), last)
+    return pairs[:, 0], pairs[:, 1]
 
-    return gene1, gene2
+# Indexes of two different parents:
+# roulette picks proportional to fitness, rank proportional to the fitness rank (1 for the worst) and tournament takes
+# the best of tournament_size random individuals. All draws come from the global random stream.
+def select_indices(fitness, method='roulette', tournament_size=3):
+    if method == 'tournament':
+        fitness = np.asarray(fitness, dtype=np.float64)
+        index1 = tournament_index(fitness, tournament_size)
+        return index1, tournament_index(fitness, tournament_size, exclude=index1)
+    return weighted_pair(selection_weights(fitness, method))
+
+# Select and return two via roulette (or rank/tournament, see select_indices), with probability of choice weighted on their fitness in the old generation
+def select(old_gen, fitness, method='roulette', tournament_size=3):
+    index1, index2 = select_indices(fitness, method, tournament_size)
+    return old_gen[index1], old_gen[index2]
 
 
 # Select and return two best indexes in the old generation for elitism later. Remember their indexes
-def select_max(old_gen, fitness1):
-    fitness = fitness1.copy()
+def select_max(old_gen, fitness):
+    fitness = np.asarray(fitness, dtype=np.float64)
 
     # Get the first index
-    max1 = (max(fitness))
-    index1 = fitness.index(max1) 
+    index1 = int(np.argmax(fitness))
 
-    # Remove first and get second best index
-    fitness.remove(max1)
-    index2 = fitness.index(max(fitness)) 
+    # Leave out the first and get second best index
+    others = fitness.copy()
+    others[index1] = -np.inf
+    index2 = int(np.argmax(others))
 
     return index1, index2
 
 # Cull random 2 in population (keeping the elite values) and then add in the mutated. This produces the next generation.
 def cull_random(population, fitness):
 
-    
     # Inverse the fitness so we can weigh bad ones higher, +1 for smoothing of weights
-    inverse = fitness.copy()
-    max_inverse = max(inverse)
-    inverse = list(map(lambda x: max_inverse - x + 1, inverse))
+    fitness = np.asarray(fitness, dtype=np.float64)
+    inverse = fitness.max() - fitness + 1
 
     # Cull two random ones weighted towards the bad ones.
-    #print(population)
-    #print(inverse)
-    to_cull1 = random.choices(population, weights=inverse, k = 1)
-    to_cull1 = to_cull1[0]
-    inverse.remove(inverse[population.index(to_cull1)])
-    population.remove(to_cull1)
-
-    to_cull2 = random.choices(population, weights=inverse, k = 1)
-    to_cull2 = to_cull2[0]
-    inverse.remove(inverse[population.index(to_cull2)])
-    population.remove(to_cull2)
+    to_cull1, to_cull2 = weighted_pair(inverse)
+    for index in sorted((to_cull1, to_cull2), reverse=True):
+        del population[index]
 
     # Return population
-    return population
\ No newline at end of file
+    return population
@@ -0,0 +1,88 @@
+import cProfile
+import json
+import os
+import pstats
+import signal
+from collections import Counter
+from contextlib import contextmanager
+
+# Structured log and profilers for genetic_algorithm runs.
+# MetricsLog can be passed as on_metrics to genetic_algorithm and writes one JSON object per generation.
+# profiled() wraps a whole run in cProfile or in a sampling profiler, only the calling process is profiled
+# (not the evaluation workers or islands).
+
+# Like the corpus writers, position() is stored in GA checkpoints and MetricsLog(path, position) carries on from it
+class MetricsLog:
+    format = 'metrics'
+
+    def __init__(self, path, position=None):
+        self.path = path
+        if position is None:
+            self.file = open(path, 'w')
+            self.records = 0
+        else:
+            os.truncate(path, position["offset"])
+            self.file = open(path, 'a')
+            self.records = position["records"]
+
+    def position(self):
+        return {"path": os.path.abspath(self.path), "format": self.format, "records": self.records, "offset": self.file.tell()}
+
+    def __call__(self, metrics):
+        self.file.write(json.dumps(metrics) + '\n')
+        self.file.flush()
+        self.records += 1
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# mode 'cprofile' dumps the pstats of the block to path and prints the top functions by cumulative time.
+# mode 'sample' samples the stack every interval seconds of CPU time (SIGPROF, so Unix only) and writes the counts in
+# collapsed stack format (one 'outer;...;inner count' line per stack, the input of flamegraph tools), then prints the
+# functions most often on top of the stack. Any other mode (None) runs the block unprofiled.
+@contextmanager
+def profiled(mode, path, interval=0.005, top=15):
+    if mode == 'cprofile':
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(path)
+            pstats.Stats(profiler).sort_stats('cumulative').print_stats(top)
+    elif mode == 'sample':
+        samples = Counter()
+
+        def sample(signum, frame):
+            stack = []
+            while frame is not None:
+                stack.append(f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}")
+                frame = frame.f_back
+            samples[';'.join(reversed(stack))] += 1
+
+        previous = signal.signal(signal.SIGPROF, sample)
+        signal.setitimer(signal.ITIMER_PROF, interval, interval)
+        try:
+            yield
+        finally:
+            signal.setitimer(signal.ITIMER_PROF, 0, 0)
+            signal.signal(signal.SIGPROF, previous)
+            with open(path, 'w') as f:
+                for stack, count in samples.most_common():
+                    f.write(f"{stack} {count}\n")
+            leaves = Counter()
+            for stack, count in samples.items():
+                leaves[stack.rsplit(';', 1)[-1]] += count
+            total = sum(samples.values())
+            print(f"Profile = {path} ({total} samples)")
+            for function, count in leaves.most_common(top):
+                print(f"{100 * count / total:6.1f}% {function}")
+    else:
+        yield
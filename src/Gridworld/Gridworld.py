@@ -1,9 +1,113 @@
 import numpy as np
 import random
 
-def randPair(s,e, legal_pos=None):
+# rng is a numpy Generator, without one the global np.random state is used
+def randPair(s,e, legal_pos=None, rng=None):
+    if rng is not None:
+        return int(rng.integers(s,e)), int(rng.integers(s,e))
     return np.random.randint(s,e), np.random.randint(s,e)
 
+# Bit flags stored per cell in GridBoard.cells, so a cell can be queried with one lookup
+WALL = 1
+PIT = 2
+GOAL = 4
+CELL_FLAGS = {'Wall': WALL, 'Pit': PIT, 'Goal': GOAL}
+
+# Channel layout of GridBoard.render_obs
+OBS_CHANNELS = ('Player', 'Walls', 'Pits', 'Goals', 'Paths')
+OBS_PLAYER, OBS_WALLS, OBS_PITS, OBS_GOALS, OBS_PATHS = range(len(OBS_CHANNELS))
+
+# Consecutive rejected draws after which initGridRandSparse takes the board as full
+MAX_REJECTIONS = 100000
+
+# Positions that are still free for initGridRand, in the same order as the original list of legal positions.
+# Backed by a Fenwick tree over a presence bitmap so len, indexing and remove are O(log n) instead of the O(n) of a list,
+# while random.choice picks exactly the same positions as it would from the list.
+class LegalPositions:
+    def __init__(self, rows, cols):
+        self.rows = rows
+        self.cols = cols
+        n = rows * cols
+        self.present = bytearray(b'\x01') * n
+        self.count = n
+        tree = [0] * (n + 1)
+        for i in range(1, n + 1):
+            tree[i] += 1
+            parent = i + (i & -i)
+            if parent <= n:
+                tree[parent] += tree[i]
+        self.tree = tree
+        self.top_bit = 1 << (n.bit_length() - 1) if n else 0
+
+    def __len__(self):
+        return self.count
+
+    def _index(self, pos):
+        if 0 <= pos[0] < self.rows and 0 <= pos[1] < self.cols:
+            return pos[0] * self.cols + pos[1]
+        return -1
+
+    def __contains__(self, pos):
+        i = self._index(pos)
+        return i >= 0 and bool(self.present[i])
+
+    def __getitem__(self, k):
+        if k < 0:
+            k += self.count
+        if not 0 <= k < self.count:
+            raise IndexError('LegalPositions index out of range')
+        # Descend the tree to the (k+1)-th present position
+        i = 0
+        bit = self.top_bit
+        tree = self.tree
+        while bit:
+            nxt = i + bit
+            if nxt < len(tree) and tree[nxt] <= k:
+                i = nxt
+                k -= tree[nxt]
+            bit >>= 1
+        return divmod(i, self.cols)
+
+    def remove(self, pos):
+        i = self._index(pos)
+        if i < 0 or not self.present[i]:
+            raise ValueError(f'{pos} is not a legal position')
+        self.present[i] = 0
+        self.count -= 1
+        i += 1
+        tree = self.tree
+        while i < len(tree):
+            tree[i] -= 1
+            i += i & -i
+
+# Dict backed stand-in for a (size, size) per-cell array of a sparse board: only the cells that differ from default are
+# stored. Cells are keyed by row*size+col and can be read and written with that id or a (row, col) pair like the arrays.
+class SparseCells:
+    def __init__(self, size, default=0):
+        self.size = size
+        self.default = default
+        self.values = {}
+
+    def _key(self, key):
+        return key[0]*self.size + key[1] if isinstance(key, tuple) else key
+
+    def __getitem__(self, key):
+        return self.values.get(self._key(key), self.default)
+
+    def __setitem__(self, key, value):
+        key = self._key(key)
+        if value == self.default:
+            self.values.pop(key, None)
+        else:
+            self.values[key] = value
+
+    def __len__(self):
+        return len(self.values)
+
+    # Sorted ids of the stored cells, only the ones with a bit of flag set if it is given
+    def ids(self, flag=None):
+        return np.array(sorted(i for i, value in self.values.items() if flag is None or value & flag), dtype=np.int64)
+
 class BoardPiece:
     
     def __init__(self, name, code, pos):
@@ -11,18 +115,56 @@ class BoardPiece:
         self.code = code #an ASCII character to display on the board
         self.pos = pos #2-tuple e.g. (1,4)
 
+# Paths are not stored as pieces: every cell keeps a visit count and the code of its last path mark, so memory is bounded
+# by the board size instead of the episode length. history > 0 also keeps the last history visited positions in a ring buffer.
 class GridBoard:
-    def __init__(self, size=4):
+    sparse = False
+
+    def __init__(self, size=4, history=0):
         self.size = size #Board dimensions, e.g. 4 x 4
         self.components = {} #name : board piece
         self.components["Walls"] = []
         self.components["Goals"] = []
         self.components["Pits"] = []
-        self.components["Paths"] = []
         self.starting_pos = (0,0)
+        self.cells = np.zeros((self.size, self.size), dtype=np.uint8) #cell type flags, kept in sync with components
+        self.version = 0 #bumped whenever cells changes so derived per-board data can be dropped
+        self.visits = np.zeros((self.size, self.size), dtype=np.uint32) #times a path was marked on each cell
+        self.path_codes = np.full((self.size, self.size), '', dtype='<U1') #code of the last path mark of each cell
+        self.history = np.zeros((history, 2), dtype=np.int32) #ring buffer of the most recent path positions
+        self.history_len = 0
+        self.history_head = 0
+        self.obs = None #render_obs buffer, created on first use and then kept up to date incrementally
+        self._obs_version = -1
+        self._obs_player = None
     
+    def in_bounds(self, pos):
+        return 0 <= pos[0] < self.size and 0 <= pos[1] < self.size
+
+    # Flags of the cell at pos (0 for empty or off-board cells)
+    def cell_at(self, pos):
+        if 0 <= pos[0] < self.size and 0 <= pos[1] < self.size:
+            return self.cells[pos[0], pos[1]]
+        return 0
+
+    # Recompute the flags of a single cell from the component lists (used when a static piece moves or is removed)
+    def refresh_cell(self, pos):
+        if not self.in_bounds(pos):
+            return
+        flags = 0
+        for name, flag in CELL_FLAGS.items():
+            for piece in self.components[name + 's']:
+                if piece.pos == pos:
+                    flags |= flag
+                    break
+        self.cells[pos[0], pos[1]] = flags
+        self.version += 1
+
     def addPiece(self, name, code, pos=(0,0)):
         newPiece = BoardPiece(name, code, pos)
+        if name in CELL_FLAGS and self.in_bounds(pos):
+            self.cells[pos[0], pos[1]] |= CELL_FLAGS[name]
+            self.version += 1
         if name == 'Wall':
             self.components['Walls'].append(newPiece)
         if name == 'Goal':
@@ -30,22 +172,54 @@ class GridBoard:
         if name == 'Pit':
             self.components['Pits'].append(newPiece)
         if name == 'Path':
-            self.components['Paths'].append(newPiece)
+            self.visit(pos, code)
         else:
             self.components[name] = newPiece
+
+    # Mark a path through pos
+    def visit(self, pos, code='*'):
+        if not self.in_bounds(pos):
+            return
+        self.visits[pos[0], pos[1]] += 1
+        self.path_codes[pos[0], pos[1]] = code
+        if self.obs is not None:
+            self.obs[OBS_PATHS, pos[0], pos[1]] = 1
+        capacity = len(self.history)
+        if capacity:
+            self.history[self.history_head] = pos
+            self.history_head = (self.history_head + 1) % capacity
+            self.history_len = min(self.history_len + 1, capacity)
+
+    # Most recent path positions, oldest first (at most the history capacity)
+    def recent_visits(self):
+        start = (self.history_head - self.history_len) % max(len(self.history), 1)
+        order = (start + np.arange(self.history_len)) % max(len(self.history), 1)
+        return [tuple(pos) for pos in self.history[order].tolist()]
+
+    def clear_paths(self):
+        self.visits[:] = 0
+        self.path_codes[:] = ''
+        if self.obs is not None:
+            self.obs[OBS_PATHS] = 0
+        self.history_len = 0
+        self.history_head = 0
     
     def movePiece(self, name, pos):
+        old_pos = self.components[name].pos
         self.components[name].pos = pos
+        if name in CELL_FLAGS:
+            self.refresh_cell(old_pos)
+            self.refresh_cell(pos)
     
     def delPiece(self, name):
         if name == "Wall":
-            self.components["Walls"].pop()
+            self.refresh_cell(self.components["Walls"].pop().pos)
         elif name == "Pit":
-            self.components["Pits"].pop()
+            self.refresh_cell(self.components["Pits"].pop().pos)
         elif name == "Goal":
-            self.components["Goals"].pop()
+            self.refresh_cell(self.components["Goals"].pop().pos)
         elif name == "Path":
-            self.components["Paths"].pop()
+            self.clear_paths()
         else:
             del self.components[name]
     
@@ -61,9 +235,9 @@ class GridBoard:
             elif name == 'Pits':
                 for pit in piece:
                     displ_board[pit.pos] = pit.code
-            elif name == 'Paths':
-                for path in piece:
-                    displ_board[path.pos] = path.code
+                # Paths are drawn over walls, goals and pits
+                visited = self.visits > 0
+                displ_board[visited] = self.path_codes[visited]
             elif name == 'Goals':
                 for goal in piece:
                     displ_board[goal.pos] = goal.code
@@ -73,8 +247,35 @@ class GridBoard:
         displ_board[player.pos] = player.code
         return displ_board
     
+    # Fixed (len(OBS_CHANNELS), size, size) uint8 observation. The board keeps one buffer that is updated incrementally:
+    # path marks are set as they are made, the player cell is moved and walls/pits/goals are only redrawn after pieces changed.
+    # Without out the board's buffer itself is returned (it changes with the board), otherwise it is copied into out.
+    def render_obs(self, out=None):
+        obs = self.obs
+        if obs is None:
+            obs = self.obs = np.zeros((len(OBS_CHANNELS), self.size, self.size), dtype=np.uint8)
+            obs[OBS_PATHS] = self.visits > 0
+        if self._obs_version != self.version:
+            obs[OBS_WALLS] = (self.cells & WALL) != 0
+            obs[OBS_PITS] = (self.cells & PIT) != 0
+            obs[OBS_GOALS] = (self.cells & GOAL) != 0
+            self._obs_version = self.version
+        player = self.components.get('Player')
+        player_pos = player.pos if player is not None and self.in_bounds(player.pos) else None
+        if player_pos != self._obs_player:
+            if self._obs_player is not None:
+                obs[OBS_PLAYER, self._obs_player[0], self._obs_player[1]] = 0
+            if player_pos is not None:
+                obs[OBS_PLAYER, player_pos[0], player_pos[1]] = 1
+            self._obs_player = player_pos
+        if out is None:
+            return obs
+        np.copyto(out, obs)
+        return out
+
+    # One layer per piece, paths share a single layer of visited cells
     def render_np(self):
-        num_pieces = len(self.components)
+        num_pieces = sum(len(piece) if isinstance(piece, list) else 1 for piece in self.components.values()) + 1
         displ_board = np.zeros((num_pieces, self.size, self.size), dtype=np.uint8)
         layer = 0
         for name, piece in self.components.items():
@@ -88,11 +289,6 @@ class GridBoard:
                     pos = (layer,) + pit.pos
                     displ_board[pos] = 1
                     layer += 1
-            elif name == 'Paths':
-                for path in piece:
-                    pos = (layer,) + path.pos
-                    displ_board[pos] = 1
-                    layer += 1
             elif name == 'Goals':
                 for goal in piece:
                     pos = (layer,) + goal.pos
@@ -102,28 +298,182 @@ class GridBoard:
                 pos = (layer,) + piece.pos
                 displ_board[pos] = 1
                 layer += 1
+            if name == 'Pits':
+                displ_board[layer] = self.visits > 0
+                layer += 1
         return displ_board
         
         
+# GridBoard that stores only the occupied cells, for boards far too large for dense (size, size) arrays.
+# cells, visits and path_codes are SparseCells, so everything that reads single cells works unchanged. The whole-board
+# renderers are replaced by render_chunks, which draws the board as tiles and skips the empty ones.
+class SparseGridBoard(GridBoard):
+    sparse = True
+
+    def __init__(self, size=4, history=0):
+        # The dense arrays of GridBoard are made for a single cell and replaced
+        super().__init__(size=1, history=history)
+        self.size = size
+        self.cells = SparseCells(size)
+        self.visits = SparseCells(size)
+        self.path_codes = SparseCells(size, default='')
+
+    def clear_paths(self):
+        self.visits = SparseCells(self.size)
+        self.path_codes = SparseCells(self.size, default='')
+        self.history_len = 0
+        self.history_head = 0
+
+    # Rows, cols and codes of what render draws, layer by layer in drawing order (later layers are drawn over earlier ones)
+    def _char_layers(self):
+        layers = []
+        for name, piece in self.components.items():
+            pieces = piece if isinstance(piece, list) else [piece]
+            layers.append(([p.pos[0] for p in pieces], [p.pos[1] for p in pieces], [p.code for p in pieces]))
+            if name == 'Pits':
+                visited = sorted(self.visits.values)
+                rows, cols = np.divmod(np.array(visited, dtype=np.int64), self.size)
+                layers.append((rows, cols, [self.path_codes[i] for i in visited]))
+        player = self.components["Player"]
+        layers.append(([player.pos[0]], [player.pos[1]], [player.code]))
+        return layers
+
+    # Rows, cols and channel of every set cell of render_obs
+    def _obs_layers(self):
+        layers = []
+        for channel, ids in ((OBS_WALLS, self.cells.ids(WALL)), (OBS_PITS, self.cells.ids(PIT)), (OBS_GOALS, self.cells.ids(GOAL)),
+                             (OBS_PATHS, np.array(sorted(self.visits.values), dtype=np.int64))):
+            rows, cols = np.divmod(ids, self.size)
+            layers.append((rows, cols, channel))
+        player = self.components.get('Player')
+        if player is not None and self.in_bounds(player.pos):
+            layers.append(([player.pos[0]], [player.pos[1]], OBS_PLAYER))
+        return layers
+
+    # Tiles of chunk x chunk cells (smaller at the right and bottom edges) that hold a piece or a path, as
+    # ((row, col) of the tile's top left cell, tile) in row-major order. The tiles are the render characters or with
+    # obs=True the render_obs channels. Memory is bounded by the occupied cells plus one tile.
+    def render_chunks(self, chunk=64, obs=False):
+        tiles_per_row = -(-self.size // chunk)
+        layers = []
+        for rows, cols, values in (self._obs_layers() if obs else self._char_layers()):
+            rows = np.asarray(rows, dtype=np.int64)
+            cols = np.asarray(cols, dtype=np.int64)
+            keys = (rows // chunk) * tiles_per_row + cols // chunk
+            order = np.argsort(keys, kind='stable')
+            values = values if obs else np.asarray(values, dtype='<U2')[order] if len(order) else np.empty(0, dtype='<U2')
+            layers.append((keys[order], rows[order], cols[order], values))
+        occupied = np.unique(np.concatenate([layer[0] for layer in layers])) if layers else []
+        for key in occupied.tolist():
+            row0, col0 = (key // tiles_per_row) * chunk, (key % tiles_per_row) * chunk
+            shape = (min(chunk, self.size - row0), min(chunk, self.size - col0))
+            if obs:
+                tile = np.zeros((len(OBS_CHANNELS),) + shape, dtype=np.uint8)
+            else:
+                tile = np.full(shape, ' ', dtype='<U2')
+            for keys, rows, cols, values in layers:
+                start, end = np.searchsorted(keys, [key, key + 1])
+                if obs:
+                    tile[values, rows[start:end] - row0, cols[start:end] - col0] = 1
+                else:
+                    tile[rows[start:end] - row0, cols[start:end] - col0] = values[start:end]
+            yield (row0, col0), tile
+
+    # Dense renders of the whole board from its tiles, only sensible for boards that fit in memory
+    def render(self):
+        displ_board = np.full((self.size, self.size), ' ', dtype='<U2')
+        for (row, col), tile in self.render_chunks():
+            displ_board[row:row + tile.shape[0], col:col + tile.shape[1]] = tile
+        return displ_board
+
+    def render_obs(self, out=None):
+        obs = out if out is not None else np.zeros((len(OBS_CHANNELS), self.size, self.size), dtype=np.uint8)
+        obs[:] = 0
+        for (row, col), tile in self.render_chunks(obs=True):
+            obs[:, row:row + tile.shape[1], col:col + tile.shape[2]] = tile
+        return obs
+
+    def render_np(self):
+        raise ValueError("render_np has a dense layer per piece, use render_chunks on sparse boards")
+        
 def addTuple(a,b):
     return tuple([sum(x) for x in zip(a,b)])
         
+# sparse=True stores the board in a SparseGridBoard, for very large boards with few pieces
 class Gridworld:
-    def __init__(self, size=4, mode='static'):
+    # rng is a numpy Generator the random modes place their pieces with, without one they use the random module.
+    # num_walls and num_pits are the walls and pits of the random mode, by default size*size/10 and size*size/20
+    # (a sparse board only pays off with far fewer pieces than that).
+    def __init__(self, size=4, mode='static', history=0, sparse=False, rng=None, num_walls=None, num_pits=None):
+        self.rng = rng
+        self.num_walls = num_walls
+        self.num_pits = num_pits
+        board_class = SparseGridBoard if sparse else GridBoard
         if size >= 4:
-            self.board = GridBoard(size=size)
+            self.board = board_class(size=size, history=history)
         else:
             print("Minimum board size is 4. Initialized to size 4.")
-            self.board = GridBoard(size=4)
+            self.board = board_class(size=4, history=history)
         
+        self._boundary_mask = None
+        self._boundary_version = -1
+
         #Add pieces, positions will be updated later
             
         if mode == 'static':
             self.initGridStatic()
         elif mode == 'player':
             self.initGridPlayer()
+        elif mode == 'empty':
+            pass
         else:
             self.initGridRand()
+
+    # random.choice / random.randrange, drawn from self.rng when the game has one
+    def _choice(self, seq):
+        if self.rng is None:
+            return random.choice(seq)
+        if not len(seq):
+            raise IndexError('Cannot choose from an empty sequence')
+        return seq[int(self.rng.integers(len(seq)))]
+
+    def _randrange(self, n):
+        if self.rng is None:
+            return random.randrange(n)
+        return int(self.rng.integers(n))
+
+    # Build a game from a layout made by generate_boards: cells holds the WALL/PIT/GOAL flags of every cell
+    @classmethod
+    def from_layout(cls, cells, player_pos, sparse=False):
+        game = cls(size=cells.shape[0], mode='empty', sparse=sparse)
+        player_pos = (int(player_pos[0]), int(player_pos[1]))
+        game.board.addPiece('Player', 'P', player_pos)
+        game.board.starting_pos = player_pos
+        for flag, name, code in ((GOAL, 'Goal', 'G'), (WALL, 'Wall', 'W'), (PIT, 'Pit', '-')):
+            for row, col in zip(*np.nonzero(cells & flag)):
+                game.board.addPiece(name, code, (int(row), int(col)))
+        return game
+
+    # Build a game from the coordinates of its pieces, for large sparse boards that from_layout would need a dense array
+    # for. goals defaults to the last column like the random mode.
+    @classmethod
+    def from_pieces(cls, size, player_pos, walls=(), pits=(), goals=None, sparse=True):
+        game = cls(size=size, mode='empty', sparse=sparse)
+        player_pos = (int(player_pos[0]), int(player_pos[1]))
+        game.board.addPiece('Player', 'P', player_pos)
+        game.board.starting_pos = player_pos
+        goals = [(row, game.board.size-1) for row in range(game.board.size)] if goals is None else goals
+        for positions, name, code in ((goals, 'Goal', 'G'), (walls, 'Wall', 'W'), (pits, 'Pit', '-')):
+            for row, col in positions:
+                game.board.addPiece(name, code, (int(row), int(col)))
+        return game
+
+    # Walls and pits initGridRand places
+    def _piece_counts(self):
+        size = self.board.size
+        num_walls = int(size * size / 10) + 1 if self.num_walls is None else self.num_walls
+        num_pits = int(size * size / 20) + 1 if self.num_pits is None else self.num_pits
+        return num_walls, num_pits
     
     #Initialize stationary grid, all items are placed deterministically
     def initGridStatic(self):
@@ -146,6 +496,9 @@ class Gridworld:
             elif name == 'Pits':
                 for pit in piece:
                     all_positions.append(pit.pos)
+            elif name in CELL_FLAGS:
+                # 'Wall', 'Goal' and 'Pit' alias the last piece added to their list
+                continue
             else:
                 all_positions.append(piece.pos)
         if len(all_positions) > len(set(all_positions)):
@@ -157,38 +510,37 @@ class Gridworld:
     def initGridPlayer(self):
         #height x width x depth (number of pieces)
         self.initGridStatic()
-        #place player
-        self.board.components['Player'].pos = randPair(0,self.board.size)
-
-        if (not self.validateBoard()):
-            #print('Invalid grid. Rebuilding..')
-            self.initGridPlayer()
+        #place player, redrawing until it does not overlap another piece
+        self.board.components['Player'].pos = randPair(0,self.board.size, rng=self.rng)
+        while not self.validateBoard():
+            self.board.components['Player'].pos = randPair(0,self.board.size, rng=self.rng)
+        self.board.starting_pos = self.board.components['Player'].pos
 
     #Initialize grid so that goal, pit, wall, player are all randomly placed
     def initGridRand(self):
+        if self.board.sparse:
+            return self.initGridRandSparse()
         #height x width x depth (number of pieces)
-        legal_pos = []
+        legal_pos = LegalPositions(self.board.size, self.board.size-1)
         player_pos = []
         for i in range(0, self.board.size):
-            for j in range(0, self.board.size-1):
-                legal_pos.append((i,j))
-                if j == 0:
-                    player_pos.append((i,j))
+            player_pos.append((i,0))
 
-        propose_pos = random.choice(player_pos)
+        propose_pos = self._choice(player_pos)
         self.board.addPiece('Player', 'P', propose_pos)
         self.board.starting_pos = propose_pos
         legal_pos.remove(propose_pos)
 
-        propose_pos = random.choice(legal_pos)
+        propose_pos = self._choice(legal_pos)
         for j in range(0, self.board.size):
             self.board.addPiece('Goal', 'G', (j, self.board.size-1))
         legal_pos.remove(propose_pos)
 
 
+        num_walls, num_pits = self._piece_counts()
         placed_walls = 0
-        while placed_walls <= (self.board.size * self.board.size) / 10:
-            propose_pos = random.choice(legal_pos)
+        while placed_walls < num_walls:
+            propose_pos = self._choice(legal_pos)
             self.board.addPiece('Wall', 'W', propose_pos)
             legal_pos.remove(propose_pos)
 
@@ -211,8 +563,8 @@ class Gridworld:
             placed_walls += 1
 
         placed_pits = 0
-        while placed_pits <= (self.board.size * self.board.size) / 20:
-            propose_pos = random.choice(legal_pos)
+        while placed_pits < num_pits:
+            propose_pos = self._choice(legal_pos)
             self.board.addPiece('Pit', '-', propose_pos)
             legal_pos.remove(propose_pos)
             # Get rid of all the illegal stuff so that we have free spaces here
@@ -233,6 +585,48 @@ class Gridworld:
 
             placed_pits += 1
         
+    # initGridRand without the legal position list: a random cell is drawn again while it is the player, the position
+    # initGridRand takes out along with the goals, or has a wall or pit in its 3x3 neighbourhood (looked up in the board
+    # cells). That is the same distribution as choosing from the list of legal positions, and nothing but the pieces is
+    # stored. Draws get slower as the board fills up, after MAX_REJECTIONS misses in a row no free position is assumed.
+    def initGridRandSparse(self):
+        size = self.board.size
+        cols = size - 1
+        cells = self.board.cells
+        taken = set()
+
+        def free(i):
+            if i in taken:
+                return False
+            row, col = divmod(i, cols)
+            for r in range(max(row - 1, 0), min(row + 2, size)):
+                for c in range(max(col - 1, 0), min(col + 2, cols)):
+                    if cells[r, c] & (WALL | PIT):
+                        return False
+            return True
+
+        def draw():
+            for _ in range(MAX_REJECTIONS):
+                i = self._randrange(size * cols)
+                if free(i):
+                    return divmod(i, cols)
+            raise IndexError('Cannot choose from an empty sequence')
+
+        propose_pos = (self._randrange(size), 0)
+        self.board.addPiece('Player', 'P', propose_pos)
+        self.board.starting_pos = propose_pos
+        taken.add(propose_pos[0]*cols)
+
+        # Like initGridRand one random legal position is taken out along with the goals
+        row, col = draw()
+        taken.add(row*cols + col)
+        for j in range(0, size):
+            self.board.addPiece('Goal', 'G', (j, size-1))
+
+        for (name, code), count in zip((('Wall', 'W'), ('Pit', '-')), self._piece_counts()):
+            for _ in range(count):
+                self.board.addPiece(name, code, draw())
+
     def makeMove(self, action):
         #need to determine what object (if any) is in the new grid spot the player is moving to
         #actions in {u,d,l,r}
@@ -262,45 +656,47 @@ class Gridworld:
         else:
             return False
     
+    # Legal if on the board and not a wall
     def valid_move(self, pos):
-        legal_move = True
-
-        # If its a wall
-        for wall in self.board.components['Walls']:
-            if pos == wall.pos:
-                legal_move = False
-        
-        # out of bounds in rows
-        if pos[0] < 0 or pos[0] >= self.board.size:
-            legal_move = False
-
-        # out of bounds in cols
-        if pos[1] < 0 or pos[1] >= self.board.size:
-            legal_move = False
-        
-        return legal_move
+        if not self.board.in_bounds(pos):
+            return False
+        return not (self.board.cells[pos[0], pos[1]] & WALL)
     
     # Check if a position is a goal node.
     def is_goal(self, pos):
-        for goal in self.board.components['Goals']:
-            if pos == goal.pos:
-                return True
-        
-        return False
+        return bool(self.board.cell_at(pos) & GOAL)
 
     def is_wall(self, pos):
-        for wall in self.board.components['Walls']:
-            if pos == wall.pos:
-                return True
-        
-        return False
+        return bool(self.board.cell_at(pos) & WALL)
 
     def is_pit(self, pos):
-        for pit in self.board.components['Pits']:
-            if pos == pit.pos:
-                return True
-        
-        return False
+        return bool(self.board.cell_at(pos) & PIT)
+
+    # Cells with a pit directly above, below, left or right of them (boundary states).
+    # Computed once per board and recomputed only after pieces changed. On sparse boards it is a SparseCells of them.
+    def boundary_mask(self):
+        if self.board.sparse and (self._boundary_mask is None or self._boundary_version != self.board.version):
+            size = self.board.size
+            mask = SparseCells(size, default=False)
+            for row, col in zip(*np.divmod(self.board.cells.ids(PIT), size)):
+                for row_offset, col_offset in ((-1, 0), (1, 0), (0, -1), (0, 1)):
+                    if 0 <= row + row_offset < size and 0 <= col + col_offset < size:
+                        mask[int(row + row_offset), int(col + col_offset)] = True
+            self._boundary_mask = mask
+            self._boundary_version = self.board.version
+        if self._boundary_mask is None or self._boundary_version != self.board.version:
+            pit = (self.board.cells & PIT) != 0
+            mask = np.zeros_like(pit)
+            mask[1:, :] |= pit[:-1, :]
+            mask[:-1, :] |= pit[1:, :]
+            mask[:, 1:] |= pit[:, :-1]
+            mask[:, :-1] |= pit[:, 1:]
+            self._boundary_mask = mask
+            self._boundary_version = self.board.version
+        return self._boundary_mask
+
+    def is_boundary(self, pos):
+        return self.board.in_bounds(pos) and bool(self.boundary_mask()[pos[0], pos[1]])
 
     def is_player(self, pos):
         if pos == self.board.components['Player'].pos:
@@ -317,16 +713,96 @@ class Gridworld:
                 self.board.addPiece('Path', '$', pos)
     
     def remove_trace(self):
-        while self.board.components['Paths']:
-            self.board.delPiece('Path')
+        self.board.clear_paths()
 
+    # Checks every pit and goal, not only the last one added
     def getReward(self):
-        if (self.board.components['Player'].pos == self.board.components['Pit'].pos):
+        if self.is_pit(self.board.components['Player'].pos):
             return -10
-        elif (self.board.components['Player'].pos == self.board.components['Goal'].pos):
+        elif self.is_goal(self.board.components['Player'].pos):
             return 10
         else:
             return -1
 
     def dispGrid(self):
         print(self.board.render())
+
+# 3x3 neighbourhood of every cell of a batch of boards (n, size, size), reduced with np.logical_or or np.minimum
+def _window3(boards, reduce, fill):
+    padded = np.pad(boards, ((0, 0), (1, 1), (1, 1)), constant_values=fill)
+    size = boards.shape[1]
+    out = boards.copy()
+    for dr in range(3):
+        for dc in range(3):
+            out = reduce(out, padded[:, dr:dr+size, dc:dc+size])
+    return out
+
+# Place up to count pieces per board on legal cells so that no two pieces touch (not even diagonally), without rejection.
+# Same distribution as repeatedly picking a random legal cell and removing it and its neighbours from the legal cells:
+# that process is the greedy independent set over random priorities, which is built here in parallel rounds
+# (every candidate that has the lowest priority of its neighbourhood joins), and the count lowest priorities are kept.
+def _place_spread(legal, count, rng):
+    num, size, _ = legal.shape
+    priority = rng.random(legal.shape)
+    candidates = legal.copy()
+    chosen = np.zeros_like(legal)
+    while candidates.any():
+        masked = np.where(candidates, priority, np.inf)
+        winners = candidates & (masked == _window3(masked, np.minimum, np.inf))
+        chosen |= winners
+        candidates &= ~_window3(winners, np.logical_or, False)
+    ranked = np.sort(np.where(chosen, priority, np.inf).reshape(num, -1), axis=1)
+    threshold = ranked[:, min(count, size*size) - 1][:, None, None]
+    return chosen & (priority <= threshold)
+
+# Player cell can reach a goal cell moving up/down/left/right around walls (pits can be walked through)
+def solvable_boards(cells, player_pos):
+    num, size, _ = cells.shape
+    free = (cells & WALL) == 0
+    goal = (cells & GOAL) != 0
+    reach = np.zeros(cells.shape, dtype=bool)
+    reach[np.arange(num), player_pos[:, 0], player_pos[:, 1]] = True
+    solved = (reach & goal).any(axis=(1, 2))
+    while True:
+        grown = reach.copy()
+        grown[:, 1:, :] |= reach[:, :-1, :]
+        grown[:, :-1, :] |= reach[:, 1:, :]
+        grown[:, :, 1:] |= reach[:, :, :-1]
+        grown[:, :, :-1] |= reach[:, :, 1:]
+        grown &= free
+        solved |= (grown & goal).any(axis=(1, 2))
+        if solved.all() or np.array_equal(grown, reach):
+            return solved
+        reach = grown
+
+# Generate num_boards random boards at once with the piece layout of initGridRand: the player in the first column, goals in
+# the last column, size²/10 walls and then size²/20 pits that do not touch each other or a wall. Small boards get as many
+# walls and pits as fit instead of failing. Only boards where a goal is reachable are returned (unsolvable ones are redrawn).
+# Returns the (num_boards, size, size) WALL/PIT/GOAL flags and the (num_boards, 2) player positions, see Gridworld.from_layout.
+def generate_boards(num_boards, size, rng=None):
+    rng = np.random.default_rng() if rng is None else rng
+    num_walls = int(size * size / 10) + 1
+    num_pits = int(size * size / 20) + 1
+    boards = []
+    players = []
+    missing = num_boards
+    while missing > 0:
+        cells = np.zeros((missing, size, size), dtype=np.uint8)
+        cells[:, :, size-1] = GOAL
+        player_pos = np.stack([rng.integers(0, size, missing), np.zeros(missing, dtype=np.int64)], axis=1)
+
+        legal = np.ones((missing, size, size), dtype=bool)
+        legal[:, :, size-1] = False
+        legal[np.arange(missing), player_pos[:, 0], 0] = False
+        walls = _place_spread(legal, num_walls, rng)
+        cells[walls] |= WALL
+
+        legal &= ~_window3(walls, np.logical_or, False)
+        pits = _place_spread(legal, num_pits, rng)
+        cells[pits] |= PIT
+
+        ok = solvable_boards(cells, player_pos)
+        boards.append(cells[ok])
+        players.append(player_pos[ok])
+        missing -= int(ok.sum())
+    return np.concatenate(boards)[:num_boards], np.concatenate(players)[:num_boards]
@@ -0,0 +1,101 @@
+import numpy as np
+from gym import spaces
+from gym.vector import VectorEnv
+from .Gridworld import (WALL, PIT, GOAL, OBS_CHANNELS, OBS_PLAYER, OBS_WALLS, OBS_PITS, OBS_GOALS, OBS_PATHS,
+                        generate_boards)
+
+# Actions 0-3 are up, down, left, right (the 'u', 'd', 'l', 'r' of Gridworld.makeMove)
+ACTION_OFFSETS = np.array([(-1, 0), (1, 0), (0, -1), (0, 1)], dtype=np.int64)
+
+# Same rewards as Gridworld.getReward
+PIT_REWARD = -10
+GOAL_REWARD = 10
+STEP_REWARD = -1
+
+# N Gridworld boards stepped together as stacked arrays, with the move semantics of Gridworld.makeMove/valid_move:
+# moving off the board or into a wall leaves the player in place, pits can be walked through and reaching a goal ends
+# the episode. Observations are the render_obs channels of every board, (num_envs, len(OBS_CHANNELS), size, size) uint8.
+#
+# layouts is a fixed (cells, player_pos) batch as made by generate_boards that every reset goes back to,
+# without it every reset draws new solvable boards from generate_boards. Episodes are truncated after max_steps moves
+# if it is set. Finished boards are reset automatically, their last observation is in infos["final_observation"].
+# The observation returned by reset/step is a buffer that the next step overwrites, copy it to keep it.
+class VectorGridworld(VectorEnv):
+    def __init__(self, num_envs, size=8, layouts=None, max_steps=None, seed=None):
+        if layouts is not None:
+            num_envs, size = layouts[0].shape[0], layouts[0].shape[1]
+        observation_space = spaces.Box(0, 1, (len(OBS_CHANNELS), size, size), dtype=np.uint8)
+        super().__init__(num_envs, observation_space, spaces.Discrete(len(ACTION_OFFSETS)))
+        self.size = size
+        self.layouts = layouts
+        self.max_steps = max_steps
+        self.rng = np.random.default_rng(seed)
+
+        self.cells = np.zeros((num_envs, size, size), dtype=np.uint8)
+        self.start = np.zeros((num_envs, 2), dtype=np.int64)
+        self.player = np.zeros((num_envs, 2), dtype=np.int64)
+        self.steps = np.zeros(num_envs, dtype=np.int64)
+        self.obs = np.zeros((num_envs, len(OBS_CHANNELS), size, size), dtype=np.uint8)
+        self._actions = None
+
+    # Put new boards (or the fixed layouts) into the envs selected by the index array envs
+    def _load(self, envs):
+        if len(envs) == 0:
+            return
+        if self.layouts is None:
+            cells, player_pos = generate_boards(len(envs), self.size, self.rng)
+        else:
+            cells, player_pos = self.layouts[0][envs], self.layouts[1][envs]
+        self.cells[envs] = cells
+        self.start[envs] = player_pos
+        self.player[envs] = player_pos
+        self.steps[envs] = 0
+
+        obs = self.obs
+        obs[envs] = 0
+        obs[envs, OBS_WALLS] = (cells & WALL) != 0
+        obs[envs, OBS_PITS] = (cells & PIT) != 0
+        obs[envs, OBS_GOALS] = (cells & GOAL) != 0
+        obs[envs, OBS_PLAYER, player_pos[:, 0], player_pos[:, 1]] = 1
+
+    def reset_wait(self, seed=None, options=None, **kwargs):
+        if seed is not None:
+            self.rng = np.random.default_rng(seed[0] if isinstance(seed, (list, tuple)) else seed)
+        self._load(np.arange(self.num_envs))
+        return self.obs, {}
+
+    def step_async(self, actions):
+        self._actions = np.asarray(actions, dtype=np.int64)
+
+    def step_wait(self, **kwargs):
+        envs = np.arange(self.num_envs)
+        target = self.player + ACTION_OFFSETS[self._actions]
+        on_board = ((target >= 0) & (target < self.size)).all(axis=1)
+        clipped = np.clip(target, 0, self.size - 1)
+        moved = on_board & ((self.cells[envs, clipped[:, 0], clipped[:, 1]] & WALL) == 0)
+
+        # Like makeMove the cell that is left is marked as path
+        movers = envs[moved]
+        old = self.player[moved]
+        self.obs[movers, OBS_PATHS, old[:, 0], old[:, 1]] = 1
+        self.obs[movers, OBS_PLAYER, old[:, 0], old[:, 1]] = 0
+        self.player[moved] = target[moved]
+        new = self.player[moved]
+        self.obs[movers, OBS_PLAYER, new[:, 0], new[:, 1]] = 1
+        self.steps += 1
+
+        flags = self.cells[envs, self.player[:, 0], self.player[:, 1]]
+        rewards = np.where(flags & PIT, PIT_REWARD, np.where(flags & GOAL, GOAL_REWARD, STEP_REWARD)).astype(np.float64)
+        terminated = (flags & GOAL) != 0
+        truncated = (self.steps >= self.max_steps) & ~terminated if self.max_steps else np.zeros(self.num_envs, dtype=bool)
+
+        infos = {"moved": moved}
+        done = terminated | truncated
+        if done.any():
+            final = np.empty(self.num_envs, dtype=object)
+            for i in envs[done]:
+                final[i] = self.obs[i].copy()
+            infos["final_observation"] = final
+            infos["_final_observation"] = done
+            self._load(envs[done])
+        return self.obs, rewards, terminated, truncated, infos
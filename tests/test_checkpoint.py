@@ -0,0 +1,36 @@
+import random
+import numpy as np
+import pytest
+from src.Gridworld.Gridworld import Gridworld
+from fuzzing import genetic_algorithm, initialize_population, GACheckpoint, Coverage, load_ga_state, REPLACEMENTS
+
+GENERATIONS = 12
+
+def make_game(sparse=False):
+    return Gridworld(size=10, mode='random', sparse=sparse, rng=np.random.default_rng(3))
+
+def run(game, replacement, checkpoint, coverage):
+    random.seed(5)
+    np.random.seed(5)
+    population = initialize_population(12, game, rng=np.random.default_rng(5))
+    return genetic_algorithm(population, game, GENERATIONS, 0.8, 0.2, [], 0, replacement=replacement,
+                             checkpoint=checkpoint, coverage=coverage)
+
+# A run resumed from a checkpoint taken partway has to end exactly as the run that never stopped
+@pytest.mark.parametrize("with_coverage, sparse", [(False, False), (True, False), (True, True)])
+@pytest.mark.parametrize("replacement", REPLACEMENTS)
+def test_resumed_run_matches_uninterrupted_run(tmp_path, replacement, with_coverage, sparse):
+    path = str(tmp_path / 'ga.npz')
+    coverage = Coverage(make_game(sparse)) if with_coverage else None
+    # Only due at generation 7 of 12, so the file holds the state halfway through
+    expected = run(make_game(sparse), replacement, GACheckpoint(path, 7, {"replacement": replacement}), coverage)
+
+    resume = load_ga_state(path)
+    assert resume["gen_count"] == 7
+    resumed_coverage = Coverage(make_game(sparse)) if with_coverage else None
+    result = genetic_algorithm(resume["population"], make_game(sparse), resume["max_generation"], 0.8, 0.2, resume["generational_stats"],
+                               resume["gen_count"], replacement=resume["config"]["replacement"], resume=resume, coverage=resumed_coverage)
+    assert result == expected
+    if with_coverage:
+        assert resumed_coverage.stats() == coverage.stats()
+        assert resumed_coverage.corpus == coverage.corpus
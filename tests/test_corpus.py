@@ -0,0 +1,47 @@
+import json
+from fuzzing import new_trial, encode_trace
+from corpus import open_corpus_writer, CorpusReader
+
+def make_trials():
+    trials = []
+    for i, path in enumerate(['udlr', 'rrd', '', 'l' * 9]):
+        trial = new_trial()
+        trial["actual_path"] = encode_trace(list(path))
+        trial["boundary_states"] = i
+        trial["fitness"] = 1.5 * i
+        trial["reaches_goal"] = i == 1
+        trials.append(trial)
+    return trials
+
+# Both formats give the same records
+def test_binary_records_match_jsonl(tmp_path):
+    for corpus_format in ('jsonl', 'binary'):
+        with open_corpus_writer(str(tmp_path / corpus_format), corpus_format) as writer:
+            writer(0, make_trials())
+            writer(1, make_trials()[:2])
+    with open(tmp_path / 'jsonl') as f:
+        jsonl = [json.loads(line) for line in f]
+    with CorpusReader(str(tmp_path / 'binary')) as reader:
+        binary = list(reader)
+    assert binary == jsonl
+    assert binary[3]["trace"] == 'lllllllll'
+
+# A writer reopened at an earlier position() drops what was written after it and carries on from there
+def test_writer_resumes_from_position(tmp_path):
+    for corpus_format in ('jsonl', 'binary'):
+        path = str(tmp_path / ('resumed.' + corpus_format))
+        with open_corpus_writer(path, corpus_format) as writer:
+            writer(0, make_trials())
+            position = writer.position()
+            writer(1, make_trials())
+        with open_corpus_writer(path, corpus_format, position) as writer:
+            assert writer.records == 4
+            writer(1, make_trials()[:2])
+            assert writer.records == 6
+        expected = str(tmp_path / ('expected.' + corpus_format))
+        with open_corpus_writer(expected, corpus_format) as writer:
+            writer(0, make_trials())
+            writer(1, make_trials()[:2])
+        for suffix in ('', '.idx') if corpus_format == 'binary' else ('',):
+            with open(path + suffix, 'rb') as f, open(expected + suffix, 'rb') as g:
+                assert f.read() == g.read()
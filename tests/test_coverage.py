@@ -0,0 +1,21 @@
+import numpy as np
+from src.Gridworld.Gridworld import Gridworld
+from fuzzing import Coverage, evaluate_population, initialize_population
+
+# On a sparse board only the covered ids are kept, crediting the same trials as the bitmaps of the dense board
+def test_sparse_coverage_matches_dense():
+    pieces = dict(player_pos=(4, 0), walls=[(1, 2), (5, 5), (8, 3)], pits=[(7, 1), (2, 7)])
+    coverages = {}
+    for sparse in (False, True):
+        game = Gridworld.from_pieces(12, sparse=sparse, **pieces)
+        coverage = Coverage(game)
+        rng = np.random.default_rng(1)
+        for gen_count in range(3):
+            trials = coverage.update(evaluate_population(game, initialize_population(20, game, rng=rng)), gen_count)
+        coverages[sparse] = coverage, [trial["new_coverage"] for trial in trials]
+    dense, sparse = coverages[False], coverages[True]
+    assert sparse[1] == dense[1]
+    assert sparse[0].stats() == dense[0].stats()
+    assert sparse[0].corpus == dense[0].corpus
+    assert (np.flatnonzero(dense[0].transitions) == sparse[0].transitions.ids).all()
+    assert (np.flatnonzero(dense[0].boundary) == sparse[0].boundary.ids).all()
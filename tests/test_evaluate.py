@@ -0,0 +1,40 @@
+import random
+from copy import deepcopy
+import numpy as np
+import pytest
+from src.Gridworld.Gridworld import Gridworld
+from fuzzing import get_fitness, simulate, evaluate_population, initialize_population, crossover, PrefixCache, BATCH_MIN, PREFIX_MIN
+
+# evaluate_population has to give exactly the trials of get_fitness (on a copy of the game) and simulate, trace for trace
+
+def make_population(game, num_population, seed):
+    rng = np.random.default_rng(seed)
+    # The DFS seeds are far longer than the random traces, the rest have varied lengths, no-op codes and empty traces
+    population = initialize_population(num_population, game, rng=rng)
+    population += [bytearray(rng.integers(0, 6, int(rng.integers(0, 4 * game.board.size)), dtype=np.uint8).tobytes()) for _ in range(num_population)]
+    population.append(bytearray())
+    return population
+
+@pytest.mark.parametrize("size, num_population, sparse", [(4, 4, False), (8, BATCH_MIN, False), (16, 100, False), (24, 60, False), (16, 60, True)])
+def test_evaluate_population_matches_get_fitness(size, num_population, sparse):
+    random.seed(size)
+    game = Gridworld(size=size, mode='random', sparse=sparse, rng=np.random.default_rng(size))
+    population = make_population(game, num_population, size)
+
+    trials = evaluate_population(game, population)
+    assert trials == [simulate(game, trace) for trace in population]
+    assert trials == [get_fitness(deepcopy(game), trace) for trace in population]
+
+@pytest.mark.parametrize("max_nodes", [3, 100000])
+def test_prefix_cache_matches_evaluate_population(max_nodes):
+    random.seed(max_nodes)
+    game = Gridworld(size=24, mode='random', rng=np.random.default_rng(3))
+    cache = PrefixCache(game, max_nodes)
+    rng = np.random.default_rng(3)
+    population = make_population(game, 30, 3) + [bytearray(rng.integers(0, 5, PREFIX_MIN + i, dtype=np.uint8).tobytes()) for i in range(0, 100, 7)]
+    for _ in range(4):
+        assert cache.evaluate_population(population) == evaluate_population(game, population)
+        # Children share prefixes with their parents, so later generations are partly served from the trie
+        population = [child for parent1, parent2 in zip(population, reversed(population)) for child in crossover(parent1, parent2, .7)][:len(population)]
+    assert len(cache) <= max_nodes
+    assert cache.evictions > 0 if max_nodes < 10 else cache.hits > 0
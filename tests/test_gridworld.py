@@ -0,0 +1,19 @@
+import numpy as np
+from src.Gridworld.Gridworld import Gridworld, WALL, PIT
+
+def test_sparse_from_pieces_renders_like_dense():
+    pieces = dict(player_pos=(3, 0), walls=[(1, 2), (5, 5)], pits=[(7, 1)])
+    sparse = Gridworld.from_pieces(9, sparse=True, **pieces)
+    dense = Gridworld.from_pieces(9, sparse=False, **pieces)
+    assert (sparse.board.render() == dense.board.render()).all()
+    assert (sparse.board.render_obs() == dense.board.render_obs()).all()
+
+# Walls and pits are kept apart (no other wall or pit in their 3x3 neighbourhood) and only the pieces are stored
+def test_sparse_random_board_counts_and_spacing():
+    game = Gridworld(size=200, mode='random', sparse=True, rng=np.random.default_rng(0), num_walls=50, num_pits=30)
+    cells = game.board.cells
+    assert len(cells.ids(WALL)) == 50 and len(cells.ids(PIT)) == 30
+    assert len(cells) == 50 + 30 + 200
+    rows, cols = np.divmod(np.concatenate([cells.ids(WALL), cells.ids(PIT)]), 200)
+    apart = np.maximum(abs(rows[:, None] - rows[None, :]), abs(cols[:, None] - cols[None, :]))
+    assert (apart + 2 * np.eye(len(rows), dtype=int) > 1).all()
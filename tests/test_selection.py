@@ -0,0 +1,40 @@
+import random
+import pytest
+from fuzzing import select_max, cull_random, weighted_index, weighted_pair, select_indices
+
+def test_select_max_ties_take_the_first_two():
+    assert select_max(None, [3, 5, 5, 1]) == (1, 2)
+    assert select_max(None, [2, 2, 2]) == (0, 1)
+    assert select_max(None, [1, 4, 2, 4, 4]) == (1, 3)
+
+def test_select_max_second_best_is_not_the_best():
+    assert select_max(None, [9, 1, 7, 8]) == (0, 3)
+    assert select_max(None, [1, 9]) == (1, 0)
+
+# Equal genes are different individuals, the ones at the drawn indexes go and not the first equal ones
+def test_cull_random_removes_the_drawn_indexes_of_duplicate_genes():
+    for seed in range(20):
+        population = [bytearray(b'\x00\x01'), bytearray(b'\x02'), bytearray(b'\x00\x01'), bytearray(b'\x03'), bytearray(b'\x00\x01')]
+        fitness = [1.0, 4.0, 1.0, 2.0, 1.0]
+        random.seed(seed)
+        culled = set(weighted_pair([max(fitness) - value + 1 for value in fitness]))
+        expected = [gene for i, gene in enumerate(population) if i not in culled]
+        random.seed(seed)
+        survivors = cull_random(list(population), fitness)
+        assert len(survivors) == 3
+        assert all(a is b for a, b in zip(survivors, expected))
+
+@pytest.mark.parametrize("weights", [[1.0, 2.0, 3.0], [0.5, 0.0, 7.25, 1.0], [3.0] * 10, [1e-9, 1.0]])
+def test_weighted_index_draws_like_random_choices(weights):
+    for seed in range(200):
+        random.seed(seed)
+        expected = random.choices(range(len(weights)), weights)[0]
+        random.seed(seed)
+        assert weighted_index(weights) == expected
+
+@pytest.mark.parametrize("method", ['roulette', 'rank', 'tournament'])
+def test_select_indices_gives_two_different_parents(method):
+    random.seed(0)
+    for _ in range(200):
+        index1, index2 = select_indices([5.0, 5.0, 1.0, 0.5], method)
+        assert index1 != index2
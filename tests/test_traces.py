@@ -0,0 +1,19 @@
+import numpy as np
+import pytest
+from fuzzing import encode_trace, decode_trace
+
+@pytest.mark.parametrize("dtype", [np.uint8, np.int32, np.int64, np.uint16])
+def test_encode_trace_converts_code_arrays(dtype):
+    assert decode_trace(encode_trace(np.array([0, 1, 2, 3, 4], dtype=dtype))) == ['u', 'd', 'l', 'r', '?']
+
+def test_encode_trace_rejects_bad_arrays():
+    with pytest.raises(ValueError):
+        encode_trace(np.array([0, 256]))
+    with pytest.raises(ValueError):
+        encode_trace(np.array([-1, 0]))
+    with pytest.raises(TypeError):
+        encode_trace(np.array([0.0, 1.0]))
+
+def test_encode_trace_names():
+    assert encode_trace(['u', 'd', 'l', 'r']) == bytearray([0, 1, 2, 3])
+    assert encode_trace(np.array(['r', 'l'])) == bytearray([3, 2])